@@ -0,0 +1,135 @@
+import os
+import asyncio
+import threading
+from app.utils.metrics import STREAM_FRAMES_DROPPED
+
+# Multipart framing shared by every stream; only Content-Length varies per frame
+PART_PREFIX = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '
+HEADER_END = b'\r\n\r\n'
+CRLF = b'\r\n'
+
+
+def mjpeg_buffers(payload):
+    """Header, payload and trailer of one multipart part; the payload is passed through uncopied"""
+    payload = memoryview(payload).cast('B')
+    return b'%s%d%s' % (PART_PREFIX, payload.nbytes, HEADER_END), payload, CRLF
+
+
+def mjpeg_part(payload) -> bytes:
+    """One multipart/x-mixed-replace part around an encoded JPEG, built in a single join"""
+    return b''.join(mjpeg_buffers(payload))
+
+
+def write_mjpeg(fd: int, payload):
+    """Write one part straight from the encoder's buffer to a file descriptor with vectored I/O"""
+    buffers = list(mjpeg_buffers(payload))
+    if not hasattr(os, "writev"):
+        for buffer in buffers:
+            while buffer:
+                buffer = buffer[os.write(fd, buffer):]
+        return
+    while buffers:
+        written = os.writev(fd, buffers)
+        # Drop what a short write got through and resend the rest
+        while buffers and written >= len(buffers[0]):
+            written -= len(buffers[0])
+            buffers.pop(0)
+        if buffers and written:
+            buffers[0] = memoryview(buffers[0])[written:]
+
+
+class LatestFrameSlot:
+    """Size-1 mailbox for one asyncio viewer: a new frame replaces any frame the viewer hasn't taken yet.
+
+    put() is called from the detector thread and only schedules a wake-up on
+    the viewer's event loop, so waiting viewers cost a coroutine, not a thread.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, lot: str = ""):
+        self._loop = loop
+        self.lot = lot
+        self._event = asyncio.Event()
+        self._lock = threading.Lock()
+        self._frame = None
+        self._closed = False
+        self._wakeup_pending = False
+
+    def _wake(self):
+        self._wakeup_pending = False
+        self._event.set()
+
+    def _schedule_wakeup(self):
+        if self._wakeup_pending:
+            return
+        self._wakeup_pending = True
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # Event loop already closed; the viewer is gone
+            self._closed = True
+
+    def put(self, frame):
+        with self._lock:
+            replaced = self._frame is not None
+            self._frame = frame
+        if replaced:
+            STREAM_FRAMES_DROPPED.inc(self.lot)
+        self._schedule_wakeup()
+
+    async def get(self):
+        """Next frame, or None once the slot is closed"""
+        while True:
+            with self._lock:
+                frame, self._frame = self._frame, None
+            if frame is not None:
+                return frame
+            if self._closed:
+                return None
+            self._event.clear()
+            if self._frame is None and not self._closed:
+                await self._event.wait()
+
+    def close(self):
+        self._closed = True
+        self._schedule_wakeup()
+
+
+class FrameBroadcaster:
+    """Holds a lot's most recent encoded part and hands it to every subscriber's slot.
+
+    publish() never waits on viewers: a slow client simply misses the frames
+    that arrived while it was still sending an older one.
+    """
+
+    def __init__(self, lot: str = ""):
+        self.lot = lot
+        self._lock = threading.Lock()
+        self._slots = set()
+        self.latest = None
+
+    def subscribe(self, loop: asyncio.AbstractEventLoop) -> LatestFrameSlot:
+        slot = LatestFrameSlot(loop, self.lot)
+        with self._lock:
+            self._slots.add(slot)
+            if self.latest is not None:
+                slot.put(self.latest)
+        return slot
+
+    def unsubscribe(self, slot: LatestFrameSlot):
+        with self._lock:
+            self._slots.discard(slot)
+        slot.close()
+
+    def publish(self, payload):
+        part = mjpeg_part(payload)
+        with self._lock:
+            self.latest = part
+            slots = list(self._slots)
+        for slot in slots:
+            slot.put(part)
+
+    def close(self):
+        with self._lock:
+            slots, self._slots = list(self._slots), set()
+        for slot in slots:
+            slot.close()
@@ -0,0 +1,32 @@
+class DetectionCadence:
+    """Decides which frames run detection, independently of the stream frame rate.
+
+    Detection runs every 1/hz seconds of video time. A motion spike over the
+    slot regions forces an immediate detection and snaps the interval to the
+    fastest rate; every quiet detection after that backs the interval off
+    towards the slowest rate.
+    """
+
+    def __init__(self, hz: float, min_hz: float, max_hz: float,
+                 spike: float, backoff: float = 1.5):
+        self.base_interval = 1.0 / hz
+        self.min_interval = 1.0 / max_hz
+        self.max_interval = 1.0 / min_hz
+        self.spike = spike
+        self.backoff = backoff
+        self.interval = self.base_interval
+        self.last = None
+
+    def due(self, now: float, motion: float) -> bool:
+        """Whether the frame at media time `now` with the given motion level should be detected"""
+        if self.last is None:
+            return True
+        if motion >= self.spike:
+            self.interval = self.min_interval
+        return now - self.last >= self.interval
+
+    def detected(self, now: float, motion: float):
+        """Record a detection; quiet ones lengthen the interval"""
+        self.last = now
+        if motion < self.spike:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
@@ -0,0 +1,357 @@
+import numpy as np
+import sys
+import os
+import argparse
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+from app.utils.notifier import send_slot_update
+from app.utils.metrics import (
+    FRAMES_DECODED, FRAMES_DROPPED, FRAMES_PROCESSED, DETECTIONS, SLOTS_EVALUATED, SLOTS_SKIPPED,
+    FRAMES_SKIPPED, TARGET_FPS, ACTUAL_FPS, NULL_TIMER, StageTimer, observe_stages,
+)
+from app.detection.occupancy import SlotGeometry, occupancy
+from app.detection.pipeline import Preprocessor
+from app.detection.motion import MotionProbe
+from app.detection.cadence import DetectionCadence
+from app.detection.hysteresis import SlotDebouncer
+from app.detection.broadcast import write_mjpeg
+from app.detection.sources import open_source
+from app.detection.encoder import FrameEncoder
+from app.detection.overlay import OverlayCache
+from app.detection.pacing import FramePacer
+from app.detection.positions import load_slots, off_frame
+
+logger = logging.getLogger(__name__)
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts")
+
+END_POLICIES = ("stop", "loop", "restart")
+
+
+@dataclass
+class LotConfig:
+    """Everything that used to be a module global in a per-lot detector script"""
+    parking_id: str
+    name: str
+    video_source: str
+    positions_path: str
+    width: int
+    height: int
+    threshold: int  # count at which a free slot becomes occupied
+    scale: float = 1.0  # processing resolution relative to the decoded video; applied by the frame source
+    positions_scale: Optional[float] = None  # resolution positions, slot size and thresholds were recorded at; default `scale`
+    draw_slots: bool = False
+    draw_counts: bool = False
+    jpeg_quality: Optional[int] = 70  # starting (and highest) stream quality; None uses the encoder default
+    jpeg_min_quality: int = 40
+    stream_bytes_per_sec: Optional[int] = None  # target stream byte rate; quality, then resolution, drop to meet it
+    encode_budget_ms: Optional[float] = None  # target encode time per frame; resolution drops to meet it
+    stream_min_scale: float = 0.5  # smallest fraction of the processed frame size a stream is sent at
+    max_stream_fps: float = 25
+    roi_preprocess: bool = True
+    detect_hz: float = 5.0  # starting detection rate; 0 detects every frame
+    detect_min_hz: float = 1.0
+    detect_max_hz: float = 25.0
+    motion_spike: float = 10.0  # mean grey-level change in a slot that forces a detection
+    motion_gating: bool = True  # only re-evaluate slots whose pixels changed
+    slot_change_tolerance: float = 6.0  # mean grey-level change below which a slot keeps its cached state
+    threshold_exit: Optional[int] = None  # count below which an occupied slot becomes free; default 80% of threshold
+    hold_frames: int = 3  # consecutive evaluations a new state must persist before it is reported
+    hold_seconds: float = 0.0
+    min_update_interval: float = 1.0  # seconds between slot updates sent for this lot
+    end_policy: str = "stop"  # at end of video: "stop", "loop" back to the first frame, or "restart" the run
+    max_restarts: int = 5  # restarts after a failure (or end of video with "restart") before a job gives up
+    restart_delay: float = 2.0
+    prefetch_frames: int = 4  # frames decoded ahead on a separate thread; 0 decodes inline
+    drop_stale: Optional[bool] = None  # skip to the newest decoded frame; default on for camera URLs
+    source_fps: Optional[float] = None  # frame rate of an image-directory source
+    geometry: Optional[SlotGeometry] = field(default=None, compare=False, repr=False)
+
+    def __post_init__(self):
+        if self.end_policy not in END_POLICIES:
+            raise ValueError(f"Unknown end_policy for {self.parking_id}: {self.end_policy!r}")
+        if self.threshold_exit is not None and self.threshold_exit > self.threshold:
+            raise ValueError(f"threshold_exit for {self.parking_id} ({self.threshold_exit}) "
+                             f"must not exceed threshold ({self.threshold})")
+
+    def resolve(self, path: str) -> str:
+        """Paths in a lot config are relative to the bundled scripts directory"""
+        if "://" in path or os.path.isabs(path):
+            return path
+        return os.path.join(SCRIPTS_DIR, path)
+
+    @property
+    def slot_factor(self) -> float:
+        """Processing resolution relative to the one positions were recorded at"""
+        return 1.0 if self.positions_scale is None else self.scale / self.positions_scale
+
+    @property
+    def default_exit(self) -> int:
+        return int(self.threshold * 0.8) if self.threshold_exit is None else self.threshold_exit
+
+    def load_geometry(self) -> SlotGeometry:
+        """Slot rectangles and thresholds at processing resolution, with lot defaults filled in"""
+        if self.geometry is None:
+            slots = load_slots(self.resolve(self.positions_path)).astype(np.int64)
+            sizes = np.where(slots[:, 2:4] > 0, slots[:, 2:4], (self.width, self.height))
+            own = slots[:, 4] > 0
+            thresholds = np.where(own, slots[:, 4], self.threshold)
+            # A slot's own threshold keeps the lot's enter/exit ratio
+            exits = np.where(own, slots[:, 4] * self.default_exit // self.threshold, self.default_exit)
+            # Positions and sizes scale with resolution; thresholds are pixel counts, so with area
+            factor = self.slot_factor
+            xywh = np.column_stack((slots[:, :2], sizes))
+            if factor != 1.0:
+                xywh = np.round(xywh * factor).astype(np.int64)
+                xywh[:, 2:] = np.maximum(xywh[:, 2:], 1)
+                thresholds = np.round(thresholds * factor ** 2).astype(np.int64)
+                exits = np.round(exits * factor ** 2).astype(np.int64)
+            self.geometry = SlotGeometry.from_slots(xywh, thresholds, exits)
+        return self.geometry
+
+
+@dataclass
+class RunStats:
+    """Processing time spent by one run_lot loop, read by whoever schedules lots"""
+    frames: int = 0
+    busy_seconds: float = 0.0
+
+
+class ParkingDetector:
+    """Per-lot occupancy state; notifies the backend whenever the slot statuses change"""
+
+    def __init__(self, config: LotConfig, notify: Callable[[str, int], None] = send_slot_update,
+                 timer=NULL_TIMER):
+        self.config = config
+        self.notify = notify
+        self.timer = timer
+        self.geometry = config.load_geometry()
+        self.positions = self.geometry.positions
+        self.prev_parking_status = np.zeros(len(self.geometry), bool)
+        self.counts = np.zeros(len(self.geometry), np.int64)
+        self.free_slots = None
+        self.preprocessor = Preprocessor(self.geometry, config.roi_preprocess, timer)
+        self.overlay = OverlayCache(self.geometry, config.draw_counts)
+        self.overlay_stale = True
+        self.threshold = self.geometry.thresholds
+        self.debouncer = SlotDebouncer(len(self.geometry), self.threshold, self.geometry.exit_thresholds,
+                                       config.hold_frames, config.hold_seconds)
+        self.last_sent = None
+        self.last_update = float("-inf")
+        self.update_pending = False
+        self.frames = 0
+        self.detections = 0
+        self.cadence = None
+        self.probe = None
+        if config.detect_hz > 0:
+            self.cadence = DetectionCadence(config.detect_hz, config.detect_min_hz,
+                                            config.detect_max_hz, config.motion_spike)
+        if config.detect_hz > 0 or config.motion_gating:
+            self.probe = MotionProbe(self.geometry)
+
+    def check_parking_space(self, img_processed, dirty=None, now: float = 0.0):
+        """Update slot states from a binarized frame; slots outside `dirty` keep their cached counts"""
+        counts, _ = occupancy(img_processed, self.geometry, self.threshold)
+        if dirty is not None:
+            counts = np.where(dirty, counts, self.counts)
+        self.timer.lap("occupancy")
+        return self.update_state(counts, now)
+
+    def update_state(self, counts, now: float = 0.0):
+        """Feed one evaluation's counts to the debouncer and queue an update if any slot's state changed"""
+        parking_status = self.debouncer.update(counts, now)
+        space_counter = len(parking_status) - int(np.count_nonzero(parking_status))
+
+        self.counts = counts
+        self.free_slots = space_counter
+        self.overlay_stale = True
+        if not np.array_equal(parking_status, self.prev_parking_status) or self.last_sent is None:
+            self.prev_parking_status = parking_status
+            self.update_pending = True
+        self.flush_update()
+        return space_counter
+
+    def flush_update(self, force: bool = False):
+        """Send the pending free-slot count unless this lot sent one less than min_update_interval ago.
+
+        force sends it regardless, for when the run ends and there is no later frame to send it on.
+        """
+        if not self.update_pending:
+            return
+        clock = time.monotonic()
+        if not force and clock - self.last_update < self.config.min_update_interval:
+            return
+        self.update_pending = False
+        if self.free_slots == self.last_sent:
+            return
+        self.last_update = clock
+        self.last_sent = self.free_slots
+        self.notify(self.config.parking_id, self.free_slots)
+        logger.info(f"[{self.config.name}] Free slots: {self.free_slots}")
+
+    def draw_overlay(self, img_display):
+        """Draw the latest known slot states; also used on frames that skipped detection.
+
+        The slot layer is only re-rendered after a detection, and only where a slot changed.
+        """
+        if self.overlay_stale:
+            self.overlay.update(img_display.shape, self.prev_parking_status, self.counts)
+            self.overlay_stale = False
+        return self.overlay.composite(img_display)
+
+    def process(self, img, now: float = 0.0, render: bool = True):
+        """Run one frame at processing resolution (media time `now`) through the pipeline; return the frame to display.
+
+        With render=False (nobody is watching) the slot overlay is skipped.
+        """
+        self.frames += 1
+        FRAMES_PROCESSED.inc(self.config.name)
+
+        if self.probe is None:
+            self.detect(img, now=now)
+        else:
+            small = self.probe.sample(img)
+            changes = self.probe.measure(small)
+            self.timer.lap("motion")
+            motion = float(changes.max()) if len(changes) else 0.0
+            if self.cadence is None or self.cadence.due(now, motion):
+                dirty = changes >= self.config.slot_change_tolerance if self.config.motion_gating else None
+                self.detect(img, dirty, now)
+                self.probe.set_reference(small, dirty)
+                if self.cadence is not None:
+                    self.cadence.detected(now, motion)
+
+        self.flush_update()
+        self.timer.lap("state")
+        if render and self.config.draw_slots:
+            self.draw_overlay(img)
+            self.timer.lap("overlay")
+        return img
+
+    def detect(self, img, dirty=None, now: float = 0.0):
+        """Evaluate occupancy, restricted to the `dirty` slots when a mask is given"""
+        name = self.config.name
+        self.detections += 1
+        DETECTIONS.inc(name)
+        n_dirty = len(self.geometry) if dirty is None else int(np.count_nonzero(dirty))
+        SLOTS_EVALUATED.inc(name, amount=n_dirty)
+        SLOTS_SKIPPED.inc(name, amount=len(self.geometry) - n_dirty)
+        if dirty is not None and n_dirty == 0:
+            # Nothing moved, but a change seen just before may still be waiting out its hold
+            return self.update_state(self.counts, now)
+        if dirty is not None and n_dirty == len(dirty):
+            dirty = None
+        return self.check_parking_space(self.binarize(img, dirty), dirty, now)
+
+    def binarize(self, img, dirty=None):
+        preprocessor = self.preprocessor
+        if preprocessor.shape != img.shape[:2]:
+            preprocessor.prepare(img.shape)
+            outside = off_frame(self.geometry.rois, img.shape)
+            if len(outside):
+                logger.warning(f"[{self.config.name}] Slots {outside[:10].tolist()} extend past the "
+                               f"{img.shape[1]}x{img.shape[0]} frame and are clipped")
+            if preprocessor.plan is not None:
+                logger.info(f"[{self.config.name}] ROI preprocessing covers {preprocessor.plan.coverage:.0%} of the frame")
+        boxes = None if dirty is None or preprocessor.plan is None else preprocessor.plan.boxes_for(dirty)
+        return preprocessor(img, boxes)
+
+
+def run_lot(config: LotConfig, on_frame: Optional[Callable[[bytes], None]] = None,
+            stop_event=None, notify: Callable[[str, int], None] = send_slot_update,
+            stats: Optional[RunStats] = None, streaming: Optional[threading.Event] = None):
+    """Decode, detect and (when on_frame is given) JPEG-encode a lot's video until EOF or stop.
+
+    on_frame receives each encoded JPEG exactly once, however many viewers it is shown to,
+    as the encoder's own buffer (bytes or a memoryview over it), never copied.
+    When a streaming event is passed, frames are only encoded while it is set, so a
+    background job can pick up and drop viewers without restarting its detector.
+    """
+    stats = stats if stats is not None else RunStats()
+    timer = StageTimer()
+    detector = ParkingDetector(config, notify, timer)
+    source = open_source(config)
+    name = config.name
+    dropped = 0
+
+    if streaming is None:
+        streaming = threading.Event()
+        if on_frame is not None:
+            streaming.set()
+    # Detection has its own cadence, so the stream no longer needs to run faster than the source
+    stream_fps = min(source.fps, config.max_stream_fps)
+    pacer = FramePacer(source.fps, stream_fps)
+    TARGET_FPS.set(name, value=source.fps)
+
+    encoder = FrameEncoder(config, stream_fps) if on_frame is not None else None
+
+    try:
+        while stop_event is None or not stop_event.is_set():
+            if not source.live:
+                # Behind schedule: skip frames rather than let the stream lag further
+                late = pacer.behind()
+                if late:
+                    skipped = source.skip(late)
+                    if not skipped:
+                        break
+                    pacer.skipped_frames(skipped)
+                    FRAMES_SKIPPED.inc(name, amount=skipped)
+            start_time = time.monotonic()
+            timer.start()
+            frame = source.read()
+            if frame is None:
+                break
+            img, timestamp = frame
+            pacer.started(timestamp)
+            timer.lap("decode")
+            skipped = source.dropped - dropped
+            if skipped:
+                dropped = source.dropped
+                FRAMES_DROPPED.inc(name, amount=skipped)
+            FRAMES_DECODED.inc(name, amount=1 + skipped)
+
+            encoding = on_frame is not None and streaming.is_set() and pacer.stream_due(timestamp)
+            img = detector.process(img, timestamp, render=encoding)
+            if encoding:
+                payload = encoder.encode(img)
+                timer.lap("encode")
+                if payload is not None:
+                    on_frame(payload)
+                    timer.lap("publish")
+            observe_stages(name, timer.laps)
+            ACTUAL_FPS.set(name, value=pacer.rate)
+
+            stats.frames += 1
+            stats.busy_seconds += time.monotonic() - start_time
+            if not source.live:
+                # A camera delivers frames in real time; waiting on read() is the pacing
+                pacer.wait(stop_event)
+    finally:
+        source.close()
+        detector.flush_update(force=True)
+        # Only a running lot has a frame rate; a pool worker ships the removal so a migrated lot isn't overwritten
+        TARGET_FPS.remove(name)
+        ACTUAL_FPS.remove(name)
+    return detector.free_slots
+
+
+def main(parking_id: str):
+    """Command-line entry point kept for the per-lot scripts: --stream writes MJPEG to stdout"""
+    from app.detection.registry import registry
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stream', action='store_true', help='Enable MJPEG streaming to stdout')
+    args = parser.parse_args()
+
+    def write_frame(payload):
+        write_mjpeg(sys.stdout.fileno(), payload)
+
+    def print_update(pid: str, free_slots: int):
+        send_slot_update(pid, free_slots)
+        if not args.stream:
+            print(f"[INFO] Free slots: {free_slots}", flush=True)
+
+    run_lot(registry.get(parking_id), on_frame=write_frame if args.stream else None, notify=print_update)
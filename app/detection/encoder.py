@@ -0,0 +1,152 @@
+import os
+import time
+import logging
+import cv2
+import numpy as np
+from app.utils.metrics import ENCODE_SECONDS, ENCODE_BYTES
+
+logger = logging.getLogger(__name__)
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420, TJFLAG_FASTDCT
+except ImportError:
+    TurboJPEG = None
+
+# "auto" picks the fastest installed backend: turbojpeg, then simplejpeg, then OpenCV
+JPEG_ENCODER = os.getenv("JPEG_ENCODER", "auto").lower()
+DEFAULT_QUALITY = 95  # what cv2.imencode uses when no quality is given
+
+# Adaptation runs every ADAPT_FRAMES encodes, on exponentially averaged size and time
+ADAPT_FRAMES = 10
+SMOOTHING = 0.2
+QUALITY_STEP = 5
+SCALE_STEP = 0.85
+# Step back up only once comfortably under target, so settings don't oscillate
+HEADROOM = 0.7
+
+
+class OpenCvBackend:
+    name = "opencv"
+
+    def encode(self, img, quality: int):
+        ret, jpeg = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return memoryview(jpeg).cast('B') if ret else None
+
+
+class SimpleJpegBackend:
+    """libjpeg-turbo through simplejpeg: fast DCT and 4:2:0 chroma subsampling"""
+    name = "simplejpeg"
+
+    def encode(self, img, quality: int):
+        return simplejpeg.encode_jpeg(np.ascontiguousarray(img), quality=quality, colorspace='BGR',
+                                      colorsubsampling='420', fastdct=True)
+
+
+class TurboJpegBackend:
+    """libjpeg-turbo through PyTurboJPEG: fast DCT and 4:2:0 chroma subsampling"""
+    name = "turbojpeg"
+
+    def __init__(self):
+        self._turbo = TurboJPEG()
+
+    def encode(self, img, quality: int):
+        return self._turbo.encode(img, quality=quality, pixel_format=TJPF_BGR,
+                                  jpeg_subsample=TJSAMP_420, flags=TJFLAG_FASTDCT)
+
+
+def make_backend(name: str = JPEG_ENCODER):
+    """The requested JPEG backend, falling back to OpenCV when it isn't installed"""
+    if name in ("auto", "turbojpeg") and TurboJPEG is not None:
+        try:
+            return TurboJpegBackend()
+        except Exception as e:
+            # The Python package is installed but the libturbojpeg shared library isn't
+            logger.warning(f"turbojpeg unavailable: {e}")
+    if name in ("auto", "simplejpeg") and simplejpeg is not None:
+        return SimpleJpegBackend()
+    if name not in ("auto", "opencv"):
+        logger.warning(f"JPEG encoder {name!r} not available; using OpenCV")
+    return OpenCvBackend()
+
+
+class FrameEncoder:
+    """Per-lot JPEG encoder that trades quality, then resolution, to meet a byte rate and time budget.
+
+    With neither `stream_bytes_per_sec` nor `encode_budget_ms` set it encodes at
+    jpeg_quality and full size, like the original scripts.
+    """
+
+    def __init__(self, config, fps: float, backend=None):
+        self.config = config
+        self.fps = fps
+        self.backend = backend or make_backend()
+        self.max_quality = config.jpeg_quality or DEFAULT_QUALITY
+        self.min_quality = min(config.jpeg_min_quality, self.max_quality)
+        self.quality = self.max_quality
+        self.scale = 1.0
+        self.avg_bytes = None
+        self.avg_seconds = None
+        self._frames = 0
+        self._resized = None
+        self._adaptive = bool(config.stream_bytes_per_sec or config.encode_budget_ms)
+
+    def encode(self, img):
+        """Encoded JPEG for `img` (bytes or a memoryview), or None if encoding failed"""
+        if self.scale < 1.0:
+            size = (max(1, int(img.shape[1] * self.scale)), max(1, int(img.shape[0] * self.scale)))
+            if self._resized is None or self._resized.shape[1::-1] != size:
+                self._resized = np.empty((size[1], size[0]) + img.shape[2:], img.dtype)
+            img = cv2.resize(img, size, dst=self._resized, interpolation=cv2.INTER_AREA)
+        start = time.perf_counter()
+        payload = self.backend.encode(img, self.quality)
+        elapsed = time.perf_counter() - start
+        if payload is None:
+            return None
+        size = len(payload)
+        ENCODE_SECONDS.observe(self.config.name, value=elapsed)
+        ENCODE_BYTES.observe(self.config.name, value=size)
+        if self._adaptive:
+            self._track(size, elapsed)
+        return payload
+
+    def _track(self, size: int, seconds: float):
+        if self.avg_bytes is None:
+            self.avg_bytes, self.avg_seconds = size, seconds
+        else:
+            self.avg_bytes += SMOOTHING * (size - self.avg_bytes)
+            self.avg_seconds += SMOOTHING * (seconds - self.avg_seconds)
+        self._frames += 1
+        if self._frames % ADAPT_FRAMES == 0:
+            self._adapt()
+
+    def _adapt(self):
+        config = self.config
+        rate = self.avg_bytes * self.fps
+        target_rate = config.stream_bytes_per_sec
+        budget = config.encode_budget_ms / 1e3 if config.encode_budget_ms else None
+        over_rate = target_rate and rate > target_rate
+        over_time = budget and self.avg_seconds > budget
+        quality, scale = self.quality, self.scale
+
+        if over_rate and quality > self.min_quality:
+            # Quality is the cheapest lever on size
+            quality = max(self.min_quality, quality - QUALITY_STEP)
+        elif (over_rate or over_time) and scale > config.stream_min_scale:
+            # Encode time follows pixel count, and so does size once quality is at its floor
+            scale = max(config.stream_min_scale, scale * SCALE_STEP)
+        elif (not target_rate or rate < HEADROOM * target_rate) and \
+                (not budget or self.avg_seconds < HEADROOM * budget):
+            if scale < 1.0:
+                scale = min(1.0, scale / SCALE_STEP)
+            elif quality < self.max_quality:
+                quality = min(self.max_quality, quality + QUALITY_STEP)
+
+        if (quality, scale) != (self.quality, self.scale):
+            logger.info(f"[{config.name}] Stream encoding now quality {quality} at {scale:.0%} "
+                        f"({rate / 1024:.0f} KiB/s, {self.avg_seconds * 1e3:.1f} ms/frame)")
+            self.quality, self.scale = quality, scale
@@ -0,0 +1,218 @@
+import asyncio
+import threading
+import time
+import logging
+from app.detection.detector import LotConfig
+from app.detection.broadcast import FrameBroadcaster
+from app.detection.supervisor import start_run
+from app.utils.metrics import STREAM_VIEWERS
+
+logger = logging.getLogger(__name__)
+
+
+class LotStream:
+    """Single detector per lot, shared by its background job and every stream viewer.
+
+    The detector runs while the lot has a job or at least one viewer, and only
+    JPEG-encodes frames while someone is watching. A run that fails (or ends
+    with end_policy "restart") is restarted up to max_restarts times.
+    """
+
+    def __init__(self, config: LotConfig):
+        self.config = config
+        self.parking_id = config.parking_id
+        self._lock = threading.Lock()
+        self._subscribers = 0
+        self._run = None
+        self._broadcaster = None
+        self._restart_timer = None
+        self.job = False
+        self.state = "idle"
+        self.started_at = None
+        self.finished_at = None
+        self.restarts = 0
+        self.error = None
+
+    @property
+    def running(self) -> bool:
+        return self._broadcaster is not None
+
+    def _start(self):
+        logger.info(f"Starting detector for {self.parking_id} ({self.config.name})")
+        self._broadcaster = FrameBroadcaster(self.config.name)
+        self.started_at = time.time()
+        self.finished_at = None
+        self.restarts = 0
+        self.error = None
+        self._launch()
+
+    def _launch(self):
+        self.state = "running"
+        # on_exit can fire before start_run returns; _finished reads the handle under the lock
+        handle = []
+        self._run = start_run(self.config, on_frame=self._broadcaster.publish,
+                              on_exit=lambda error: self._finished(handle, error),
+                              streaming=self._subscribers > 0)
+        handle.append(self._run)
+
+    def _stop(self, state: str = "stopped"):
+        run, self._run = self._run, None
+        broadcaster, self._broadcaster = self._broadcaster, None
+        if self._restart_timer is not None:
+            self._restart_timer.cancel()
+            self._restart_timer = None
+        if broadcaster is None:
+            return
+        logger.info(f"Stopping detector for {self.parking_id}")
+        self.job = False
+        self.state = state
+        self.finished_at = time.time()
+        if run is not None:
+            run.stop()
+        broadcaster.close()
+
+    def _finished(self, handle, error):
+        with self._lock:
+            if not handle or self._run is not handle[0]:
+                # Stopped on purpose or already replaced
+                return
+            self._run = None
+            restart = error is not None or self.config.end_policy == "restart"
+            if restart and self.restarts < self.config.max_restarts:
+                self.restarts += 1
+                self.error = error
+                self.state = "restarting"
+                logger.warning(f"Detector for {self.parking_id} exited; restart {self.restarts}/"
+                               f"{self.config.max_restarts} in {self.config.restart_delay}s")
+                self._restart_timer = threading.Timer(self.config.restart_delay, self._restart)
+                self._restart_timer.daemon = True
+                self._restart_timer.start()
+                return
+            logger.info(f"[LotStream] Detector for {self.parking_id} exited")
+            self._stop("failed" if error is not None else "finished")
+            self.error = error
+
+    def _restart(self):
+        with self._lock:
+            self._restart_timer = None
+            if self.state == "restarting" and self._broadcaster is not None:
+                self._launch()
+
+    def _set_streaming(self):
+        if self._run is not None:
+            self._run.set_streaming(self._subscribers > 0)
+
+    def start_job(self) -> bool:
+        """Keep the detector running without viewers; False if this lot already had a job"""
+        with self._lock:
+            if self.job and self.running:
+                return False
+            self.job = True
+            if not self.running:
+                self._start()
+            return True
+
+    def stop_job(self) -> bool:
+        """Drop the background job; the detector keeps running while viewers remain"""
+        with self._lock:
+            if not self.job:
+                return False
+            self.job = False
+            if self._subscribers == 0:
+                self._stop()
+            return True
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "parking_id": self.parking_id,
+                "name": self.config.name,
+                "state": self.state,
+                "job": self.job,
+                "viewers": self._subscribers,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "restarts": self.restarts,
+                "error": self.error,
+                "end_policy": self.config.end_policy,
+            }
+
+    async def frames(self):
+        """Async generator of encoded MJPEG parts for one viewer until the engine stops or the client leaves"""
+        with self._lock:
+            self._subscribers += 1
+            STREAM_VIEWERS.set(self.config.name, value=self._subscribers)
+            if not self.running:
+                self._start()
+            broadcaster = self._broadcaster
+            slot = broadcaster.subscribe(asyncio.get_running_loop())
+            self._set_streaming()
+        try:
+            while True:
+                part = await slot.get()
+                if part is None:
+                    return
+                yield part
+        finally:
+            broadcaster.unsubscribe(slot)
+            with self._lock:
+                self._subscribers -= 1
+                STREAM_VIEWERS.set(self.config.name, value=self._subscribers)
+                if self._broadcaster is broadcaster:
+                    if self._subscribers == 0 and not self.job:
+                        self._stop()
+                    else:
+                        self._set_streaming()
+
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def get_lot_stream(config: LotConfig) -> LotStream:
+    """Return the shared engine for a lot, creating it on first use.
+
+    An idle engine built from an older registry entry is replaced so reloaded
+    settings take effect; a busy one keeps running until its job and viewers end.
+    """
+    with _streams_lock:
+        stream = _streams.get(config.parking_id)
+        if stream is None or (stream.config is not config and not stream.running):
+            stream = _streams[config.parking_id] = LotStream(config)
+        return stream
+
+
+def start_job(config: LotConfig):
+    """Start background detection for a lot, or return the job already running: (status, created)"""
+    stream = get_lot_stream(config)
+    created = stream.start_job()
+    return stream.status(), created
+
+
+def stop_job(parking_id: str):
+    """Stop a lot's background job; returns its status, or None if there was no job"""
+    with _streams_lock:
+        stream = _streams.get(parking_id)
+    if stream is None or not stream.stop_job():
+        return None
+    return stream.status()
+
+
+def job_status(parking_id: str):
+    with _streams_lock:
+        stream = _streams.get(parking_id)
+    return stream.status() if stream is not None else None
+
+
+def list_jobs():
+    with _streams_lock:
+        streams = list(_streams.values())
+    return [stream.status() for stream in streams]
+
+
+def stop_all_streams():
+    with _streams_lock:
+        streams = list(_streams.values())
+    for stream in streams:
+        with stream._lock:
+            stream._stop()
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+class SlotDebouncer:
+    """Per-slot occupancy with hysteresis so a count hovering at the threshold doesn't flicker.
+
+    A free slot becomes occupied once its count reaches `enter`; an occupied
+    slot becomes free only when its count falls below `exit` (<= enter).
+    Either threshold may be a scalar or a per-slot array. In
+    both directions the new reading must persist for `hold_frames`
+    consecutive evaluations and `hold_seconds` of media time before the
+    state flips. The first evaluation is taken as-is.
+    """
+
+    def __init__(self, n_slots: int, enter, exit, hold_frames: int = 1, hold_seconds: float = 0.0):
+        if np.any(np.asarray(exit) > np.asarray(enter)):
+            raise ValueError(f"Exit threshold {exit} must not exceed enter threshold {enter}")
+        self.enter = enter
+        self.exit = exit
+        self.hold_frames = max(1, hold_frames)
+        self.hold_seconds = hold_seconds
+        self.state = np.zeros(n_slots, bool)
+        self.streak = np.zeros(n_slots, np.int32)
+        self.since = np.zeros(n_slots, np.float64)
+        self.initialized = False
+
+    def update(self, counts: np.ndarray, now: float) -> np.ndarray:
+        """Feed one evaluation's per-slot counts; returns the debounced occupancy vector"""
+        if not self.initialized:
+            self.state = counts >= self.enter
+            self.initialized = True
+            return self.state
+
+        reading = np.where(self.state, counts >= self.exit, counts >= self.enter)
+        differs = reading != self.state
+        started = differs & (self.streak == 0)
+        self.since[started] = now
+        self.streak = np.where(differs, self.streak + 1, 0)
+
+        flip = differs & (self.streak >= self.hold_frames) & (now - self.since >= self.hold_seconds)
+        if flip.any():
+            self.state = self.state ^ flip
+            self.streak[flip] = 0
+        return self.state
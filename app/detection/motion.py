@@ -0,0 +1,39 @@
+import cv2
+import numpy as np
+from app.detection.occupancy import SlotGeometry, roi_sums
+
+
+class MotionProbe:
+    """Cheap per-slot change metric: mean absolute grey difference on a subsampled frame"""
+
+    def __init__(self, geometry: SlotGeometry, step: int = 4):
+        self.step = step
+        self.geometry = geometry.downscaled(step)
+        self.reference = None
+        self._areas = None
+
+    def sample(self, img):
+        """Grey image built from every `step`-th pixel; ~1/step^2 of the full-frame cost"""
+        small = np.ascontiguousarray(img[::self.step, ::self.step])
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def measure(self, small):
+        """Mean change per slot against the reference sample (inf when there is none yet)"""
+        if self.reference is None or self.reference.shape != small.shape:
+            return np.full(len(self.geometry), np.inf)
+        if self._areas is None:
+            self._areas = np.maximum(self.geometry.areas(small.shape), 1)
+        diff = cv2.absdiff(small, self.reference)
+        return roi_sums(diff, self.geometry) / self._areas
+
+    def set_reference(self, small, slots=None):
+        """Take `small` as the new reference, for every slot or only the selected ones"""
+        if slots is None or self.reference is None or self.reference.shape != small.shape or slots.all():
+            self.reference = small.copy()
+            return
+        h, w = small.shape[:2]
+        for x0, y0, x1, y1 in self.geometry.rois[slots].tolist():
+            x0, y0 = max(x0, 0), max(y0, 0)
+            self.reference[y0:min(y1, h), x0:min(x1, w)] = small[y0:min(y1, h), x0:min(x1, w)]
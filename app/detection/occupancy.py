@@ -0,0 +1,155 @@
+import cv2
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Below this many slots the full-frame integral image costs more than the per-slot loop
+INTEGRAL_MIN_SLOTS = 128
+
+
+@dataclass
+class SlotGeometry:
+    """Slot rectangles (and per-slot thresholds, when known) precomputed once per config load"""
+    positions: np.ndarray  # int32 (N, 2): x, y of each slot's top-left corner, a view of rois
+    rois: np.ndarray  # int32 (N, 4): x0, y0, x1, y1
+    thresholds: Optional[np.ndarray] = None  # int64 (N,) count at which each slot becomes occupied
+    exit_thresholds: Optional[np.ndarray] = None  # int64 (N,) count below which it becomes free again
+    _corners: dict = field(default_factory=dict, repr=False, compare=False)
+
+    @classmethod
+    def build(cls, positions, width: int, height: int):
+        positions = np.asarray(positions, np.int64).reshape(-1, 2)
+        rois = np.empty((len(positions), 4), np.int32)
+        rois[:, :2] = positions
+        rois[:, 2] = rois[:, 0] + width
+        rois[:, 3] = rois[:, 1] + height
+        return cls(rois[:, :2], rois)
+
+    @classmethod
+    def from_slots(cls, xywh: np.ndarray, thresholds=None, exit_thresholds=None):
+        """Geometry straight from an (N, 4) array of x, y, w, h, without per-slot Python work"""
+        xywh = np.asarray(xywh, np.int64).reshape(-1, 4)
+        rois = np.empty((len(xywh), 4), np.int32)
+        rois[:, :2] = xywh[:, :2]
+        rois[:, 2:] = xywh[:, :2] + xywh[:, 2:]
+        return cls(rois[:, :2], rois, thresholds, exit_thresholds)
+
+    def __len__(self):
+        return len(self.rois)
+
+    def downscaled(self, step: int):
+        """Same slots on a grid sampled every `step` pixels (rounded outwards)"""
+        rois = self.rois.copy()
+        rois[:, :2] //= step
+        rois[:, 2:] = -(-rois[:, 2:] // step)
+        return SlotGeometry(rois[:, :2], rois)
+
+    def areas(self, shape):
+        """Pixel area of each slot after clipping to a frame of the given shape"""
+        br, tr, bl, tl = self.corners(shape)
+        stride = shape[1] + 1
+        return (br % stride - bl % stride) * (br // stride - tr // stride)
+
+    def corners(self, shape):
+        """Flat indices of each ROI's four corners in the (H+1, W+1) integral image of a frame"""
+        h, w = shape[:2]
+        cached = self._corners.get((h, w))
+        if cached is None:
+            # Clip to the frame, so a slot partly off-frame counts only its visible pixels
+            x0 = np.clip(self.rois[:, 0], 0, w).astype(np.intp)
+            y0 = np.clip(self.rois[:, 1], 0, h).astype(np.intp)
+            x1 = np.maximum(np.clip(self.rois[:, 2], 0, w), x0).astype(np.intp)
+            y1 = np.maximum(np.clip(self.rois[:, 3], 0, h), y0).astype(np.intp)
+            stride = w + 1
+            cached = (y1 * stride + x1, y0 * stride + x1, y1 * stride + x0, y0 * stride + x0)
+            self._corners[(h, w)] = cached
+        return cached
+
+
+def count_nonzero_loop(img_binary, geometry: SlotGeometry):
+    """Reference per-slot countNonZero, as the original lot scripts computed it"""
+    # Negative origins would wrap around in a slice; clip them like corners() so both kernels agree
+    counts = []
+    for x0, y0, x1, y1 in np.maximum(geometry.rois, 0).tolist():
+        counts.append(cv2.countNonZero(img_binary[y0:y1, x0:x1]))
+    return np.array(counts, np.int64)
+
+
+def roi_sums(img, geometry: SlotGeometry):
+    """Pixel sum of every slot of a single-channel uint8 image, from one integral image"""
+    h, w = img.shape[:2]
+    sdepth = cv2.CV_32S if h * w * 255 < 2 ** 31 else cv2.CV_64F
+    integral = cv2.integral(img, sdepth=sdepth).ravel()
+    br, tr, bl, tl = geometry.corners(img.shape)
+    return (integral[br] - integral[tr] - integral[bl] + integral[tl]).astype(np.int64)
+
+
+def count_nonzero_rois(img_binary, geometry: SlotGeometry):
+    """Non-zero pixel count of every slot in one pass over a 0/255 binary frame.
+
+    One integral image is built for the whole frame and each slot's sum is
+    gathered from its four precomputed corners, so the cost per slot is a few
+    array lookups instead of a Python-level crop and countNonZero call.
+    """
+    return roi_sums(img_binary, geometry) // 255
+
+
+def occupancy(img_binary, geometry: SlotGeometry, threshold):
+    """Return (counts, occupied) where occupied is a boolean vector, one entry per slot"""
+    if len(geometry) >= INTEGRAL_MIN_SLOTS:
+        counts = count_nonzero_rois(img_binary, geometry)
+    else:
+        counts = count_nonzero_loop(img_binary, geometry)
+    return counts, counts >= threshold
+
+
+def count_nonzero_batch(stack, geometry: SlotGeometry):
+    """(N, slots) non-zero counts of a stack of N binary frames (N, H, W).
+
+    Each frame goes through the same OpenCV kernel occupancy() would pick:
+    measured against numpy reductions over the ROI slices of the whole stack
+    and against one integral image of the stack, that is as fast or faster at
+    every slot count, so batching here only saves the per-frame bookkeeping.
+    """
+    stack = np.asarray(stack)
+    count = count_nonzero_rois if len(geometry) >= INTEGRAL_MIN_SLOTS else count_nonzero_loop
+    counts = np.empty((len(stack), len(geometry)), np.int64)
+    for index in range(len(stack)):
+        counts[index] = count(stack[index], geometry)
+    return counts
+
+
+def majority_vote(occupied: np.ndarray, window: int, history=None) -> np.ndarray:
+    """Each frame's occupancy by majority over itself and the window - 1 readings before it.
+
+    `history` holds the readings that preceded this batch (the tail of the
+    previous one), so windows run across batch boundaries; early frames
+    without a full window vote over what there is. Ties go to the newest
+    reading.
+    """
+    if window <= 1:
+        return occupied
+    n = len(occupied)
+    if history is not None and len(history):
+        readings = np.concatenate((history[-(window - 1):], occupied))
+    else:
+        readings = occupied
+    lead = len(readings) - n
+    votes = np.zeros((len(readings) + 1, occupied.shape[1]), np.int32)
+    np.cumsum(readings, axis=0, out=votes[1:])
+    end = np.arange(lead + 1, len(readings) + 1)
+    begin = np.maximum(end - window, 0)
+    ayes = votes[end] - votes[begin]
+    size = (end - begin)[:, None]
+    return np.where(2 * ayes == size, occupied, 2 * ayes > size)
+
+
+def occupancy_batch(stack, geometry: SlotGeometry, threshold, window: int = 1, history=None):
+    """Return (counts, occupied, smoothed), each (N, slots), for a stack of N binary frames.
+
+    `smoothed` is the majority vote of `occupied` over a trailing `window` of
+    frames, continuing from the readings in `history` when given.
+    """
+    counts = count_nonzero_batch(stack, geometry)
+    occupied = counts >= threshold
+    return counts, occupied, majority_vote(occupied, window, history)
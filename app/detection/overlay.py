@@ -0,0 +1,143 @@
+import cv2
+import numpy as np
+from app.detection.occupancy import SlotGeometry
+
+FREE_COLOR = (0, 255, 0)
+OCCUPIED_COLOR = (0, 0, 255)
+TEXT_COLOR = (255, 255, 255)
+LABEL_FONT = cv2.FONT_HERSHEY_PLAIN
+LABEL_SCALE = 1
+LABEL_THICKNESS = 2
+# Pixels a slot's drawing can reach past the box it is drawn around (a 5 px outline reaches 3, plus one
+# because box ends are exclusive)
+DRAW_MARGIN = 4
+
+
+def slot_style(occupied: bool):
+    return (OCCUPIED_COLOR, 2) if occupied else (FREE_COLOR, 5)
+
+
+def draw_slot(img, x0: int, y0: int, x1: int, y1: int, occupied: bool, label=None):
+    """One slot's outline, and its count label drawn the way cvzone.putTextRect does"""
+    color, thickness = slot_style(occupied)
+    cv2.rectangle(img, (x0, y0), (x1, y1), color, thickness)
+    if label is None:
+        return
+    ox, oy = x0, y1 - 3
+    (text_w, text_h), _ = cv2.getTextSize(label, LABEL_FONT, LABEL_SCALE, LABEL_THICKNESS)
+    cv2.rectangle(img, (ox, oy), (ox + text_w, oy - text_h), color, cv2.FILLED)
+    cv2.putText(img, label, (ox, oy), LABEL_FONT, LABEL_SCALE, TEXT_COLOR, LABEL_THICKNESS)
+
+
+class OverlayCache:
+    """Slot outlines and count labels kept in a pre-rendered colour layer with an alpha mask.
+
+    update() re-renders only the slots whose occupancy or label changed (and
+    the neighbours they overlap, clipped to the changed area so drawing order
+    is preserved); composite() applies the layer with one masked copy over
+    the overlay's bounding box. The result matches drawing every slot on
+    every frame pixel for pixel.
+    """
+
+    def __init__(self, geometry: SlotGeometry, draw_counts: bool = False):
+        self.rois = geometry.rois
+        self.draw_counts = draw_counts
+        self.shape = None
+        self.color = None
+        self.alpha = None
+        self.occupied = None
+        self.labels = None
+        self.extents = None
+        self.bounds = None
+
+    def _label(self, count):
+        return str(count) if self.draw_counts else None
+
+    def _extent(self, index: int, label) -> list:
+        x0, y0, x1, y1 = self.rois[index].tolist()
+        if label is not None:
+            (text_w, text_h), _ = cv2.getTextSize(label, LABEL_FONT, LABEL_SCALE, LABEL_THICKNESS)
+            x1 = max(x1, x0 + text_w)
+            y0 = min(y0, y1 - 3 - text_h)
+        return [x0 - DRAW_MARGIN, y0 - DRAW_MARGIN, x1 + DRAW_MARGIN, y1 + DRAW_MARGIN]
+
+    def _clip(self, box):
+        h, w = self.shape
+        x0, y0, x1, y1 = box
+        return max(x0, 0), max(y0, 0), min(x1, w), min(y1, h)
+
+    def _hits(self, region):
+        rx0, ry0, rx1, ry1 = region
+        extents = self.extents
+        return np.flatnonzero((extents[:, 0] < rx1) & (extents[:, 2] > rx0) &
+                              (extents[:, 1] < ry1) & (extents[:, 3] > ry0))
+
+    def _render(self, region, hits):
+        """Clear `region` and redraw, in slot order, the slots that reach into it"""
+        rx0, ry0, rx1, ry1 = region
+        if rx1 <= rx0 or ry1 <= ry0:
+            return
+        color = self.color[ry0:ry1, rx0:rx1]
+        alpha = self.alpha[ry0:ry1, rx0:rx1]
+        color[:] = 0
+        for index in hits.tolist():
+            x0, y0, x1, y1 = self.rois[index].tolist()
+            draw_slot(color, x0 - rx0, y0 - ry0, x1 - rx0, y1 - ry0,
+                      bool(self.occupied[index]), self.labels[index])
+        # None of the overlay colours is black, so drawn pixels are exactly the non-zero ones
+        cv2.cvtColor(color, cv2.COLOR_BGR2GRAY, dst=alpha)
+        cv2.threshold(alpha, 0, 255, cv2.THRESH_BINARY, dst=alpha)
+
+    def update(self, shape, occupied: np.ndarray, counts: np.ndarray):
+        """Bring the layer in line with the current slot states and counts"""
+        n = len(self.rois)
+        labels = [self._label(count) for count in counts.tolist()] if self.draw_counts else [None] * n
+        shape = tuple(shape[:2])
+        if shape != self.shape:
+            self.shape = shape
+            self.color = np.zeros(shape + (3,), np.uint8)
+            self.alpha = np.zeros(shape, np.uint8)
+            changed = np.ones(n, bool)
+            old_extents = None
+        else:
+            changed = occupied != self.occupied
+            if self.draw_counts:
+                changed |= np.array([new != old for new, old in zip(labels, self.labels)], bool)
+            if not changed.any():
+                return
+            old_extents = self.extents
+
+        self.occupied = occupied.copy()
+        self.labels = labels
+        self.extents = np.array([self._extent(index, label) for index, label in enumerate(labels)], np.int64) \
+            if n else np.zeros((0, 4), np.int64)
+        if n:
+            self.bounds = self._clip((self.extents[:, 0].min(), self.extents[:, 1].min(),
+                                      self.extents[:, 2].max(), self.extents[:, 3].max()))
+
+        patches = []
+        if old_extents is not None:
+            for index in np.flatnonzero(changed).tolist():
+                old, new = old_extents[index], self.extents[index]
+                region = self._clip((min(old[0], new[0]), min(old[1], new[1]),
+                                     max(old[2], new[2]), max(old[3], new[3])))
+                patches.append((region, self._hits(region)))
+        # Patch only while that draws fewer slots than redrawing the whole layer would
+        if old_extents is None or sum(len(hits) for _, hits in patches) >= n:
+            self.color[:] = 0
+            self.alpha[:] = 0
+            if n:
+                self._render(self.bounds, np.arange(n))
+            return
+        for region, hits in patches:
+            self._render(region, hits)
+
+    def composite(self, img):
+        """Apply the layer to a frame in place"""
+        if self.bounds is None:
+            return img
+        x0, y0, x1, y1 = self.bounds
+        if x1 <= x0 or y1 <= y0:
+            return img
+        cv2.copyTo(self.color[y0:y1, x0:x1], self.alpha[y0:y1, x0:x1], img[y0:y1, x0:x1])
+        return img
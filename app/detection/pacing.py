@@ -0,0 +1,81 @@
+import time
+from typing import Optional
+
+# Actual frame rate is measured over windows of this many seconds
+RATE_WINDOW = 2.0
+
+
+class FramePacer:
+    """Plays a file-backed source in real time against absolute deadlines on the monotonic clock.
+
+    A frame with media time t is due at origin + t, so a long frame never pushes
+    later frames back: the next wait is simply shorter. Once a whole frame
+    period behind, the run skips frames instead of falling further behind.
+    Streamed frames are picked the same way, on media time, at most
+    `stream_fps` per second.
+    """
+
+    def __init__(self, fps: float, stream_fps: Optional[float] = None, clock=time.monotonic):
+        self.period = 1.0 / fps
+        self.stream_period = 1.0 / stream_fps if stream_fps else self.period
+        self.clock = clock
+        self.origin = None
+        self.last = None
+        self.next_stream = 0.0
+        self.rate = 0.0
+        self._window_start = None
+        self._window_frames = 0
+
+    def started(self, timestamp: float):
+        """Record that the frame at media time `timestamp` is being processed"""
+        now = self.clock()
+        if self.origin is None:
+            self.origin = now - timestamp
+            self.next_stream = timestamp
+            self._window_start = now
+        self.last = timestamp
+        self._window_frames += 1
+        if now - self._window_start >= RATE_WINDOW:
+            self.rate = self._window_frames / (now - self._window_start)
+            self._window_start = now
+            self._window_frames = 0
+
+    def next_deadline(self) -> Optional[float]:
+        if self.origin is None:
+            return None
+        return self.origin + self.last + self.period
+
+    def behind(self) -> int:
+        """Whole frames the next read is late by, i.e. how many to skip to be back on time"""
+        deadline = self.next_deadline()
+        if deadline is None:
+            return 0
+        late = self.clock() - deadline
+        return int(late / self.period) if late >= self.period else 0
+
+    def skipped_frames(self, count: int):
+        """Account for frames skipped unprocessed; their media time passes as if they had played"""
+        self.last += count * self.period
+
+    def stream_due(self, timestamp: float) -> bool:
+        """Whether the frame at `timestamp` should be streamed to stay at or under stream_fps"""
+        if timestamp < self.next_stream - 1e-6:
+            return False
+        self.next_stream += self.stream_period
+        if self.next_stream <= timestamp:
+            # Fell behind (skips, or a switch to streaming); restart the stream schedule from here
+            self.next_stream = timestamp + self.stream_period
+        return True
+
+    def wait(self, stop_event=None):
+        """Sleep until the next frame is due; returns immediately when already late"""
+        deadline = self.next_deadline()
+        if deadline is None:
+            return
+        delay = deadline - self.clock()
+        if delay <= 0:
+            return
+        if stop_event is not None:
+            stop_event.wait(delay)
+        else:
+            time.sleep(delay)
@@ -0,0 +1,203 @@
+import cv2
+import numpy as np
+from dataclasses import dataclass
+from app.detection.occupancy import SlotGeometry
+from app.utils.metrics import NULL_TIMER
+
+KERNEL = np.ones((3, 3), np.uint8)
+
+# Pixels of context each filter stage needs around an output pixel:
+# GaussianBlur 3x3, adaptiveThreshold block 25, medianBlur 5, dilate 3x3
+FILTER_HALO = 1 + 12 + 2 + 1
+
+# Above this fraction of the frame the ROI path does no less work than the full frame
+ROI_MAX_COVERAGE = 0.75
+
+
+class StageBuffers:
+    """Output image of every filter stage at one size, reused frame after frame"""
+
+    def __init__(self, shape):
+        h, w = shape[:2]
+        self.shape = (h, w)
+        self.gray = np.empty((h, w), np.uint8)
+        self.blur = np.empty((h, w), np.uint8)
+        self.thresh = np.empty((h, w), np.uint8)
+        self.median = np.empty((h, w), np.uint8)
+        self.binary = np.empty((h, w), np.uint8)
+
+
+def preprocess(img, buffers: StageBuffers = None, timer=NULL_TIMER):
+    """Binarize a BGR frame the way every lot script did; with `buffers` every stage writes in place"""
+    if buffers is None:
+        buffers = StageBuffers(img.shape)
+    cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=buffers.gray)
+    cv2.GaussianBlur(buffers.gray, (3, 3), 1, dst=buffers.blur)
+    timer.lap("gray_blur")
+    cv2.adaptiveThreshold(
+        buffers.blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY_INV, 25, 16, dst=buffers.thresh
+    )
+    timer.lap("threshold")
+    cv2.medianBlur(buffers.thresh, 5, dst=buffers.median)
+    timer.lap("median")
+    cv2.dilate(buffers.median, KERNEL, dst=buffers.binary, iterations=1)
+    timer.lap("dilate")
+    return buffers.binary
+
+
+def expand(boxes: np.ndarray, halo: int, h: int, w: int) -> np.ndarray:
+    ext = boxes.copy()
+    ext[:, :2] = np.maximum(ext[:, :2] - halo, 0)
+    ext[:, 2] = np.minimum(ext[:, 2] + halo, w)
+    ext[:, 3] = np.minimum(ext[:, 3] + halo, h)
+    return ext
+
+
+def _merge_boxes(boxes: np.ndarray, halo: int, shape) -> np.ndarray:
+    """Union boxes whose halo-expanded extents touch until no two of them do"""
+    h, w = shape[:2]
+    while len(boxes) > 1:
+        ext = expand(boxes, halo, h, w)
+        overlap = (
+            (ext[:, None, 0] < ext[None, :, 2]) & (ext[None, :, 0] < ext[:, None, 2]) &
+            (ext[:, None, 1] < ext[None, :, 3]) & (ext[None, :, 1] < ext[:, None, 3])
+        )
+        # Connected components of the overlap graph
+        labels = np.arange(len(boxes))
+        while True:
+            spread = np.where(overlap, labels[None, :], len(boxes)).min(axis=1)
+            if np.array_equal(spread, labels):
+                break
+            labels = spread
+        if len(np.unique(labels)) == len(boxes):
+            break
+        merged = []
+        for label in np.unique(labels):
+            group = boxes[labels == label]
+            merged.append((group[:, 0].min(), group[:, 1].min(), group[:, 2].max(), group[:, 3].max()))
+        boxes = np.array(merged, np.int32)
+    return boxes
+
+
+@dataclass
+class RoiPlan:
+    """Sub-images of a frame that must be filtered to reproduce every slot's binary pixels"""
+    shape: tuple
+    cores: np.ndarray       # (M, 4) disjoint regions written to the output
+    extents: np.ndarray     # (M, 4) cores plus the filter halo, clipped to the frame
+    slot_boxes: np.ndarray  # (N,) index of the core holding each slot, -1 if off-frame
+    full_frame: bool
+
+    @classmethod
+    def build(cls, geometry: SlotGeometry, shape, halo: int = FILTER_HALO):
+        h, w = shape[:2]
+        rects = geometry.rois.copy()
+        rects[:, [0, 2]] = np.clip(rects[:, [0, 2]], 0, w)
+        rects[:, [1, 3]] = np.clip(rects[:, [1, 3]], 0, h)
+        on_frame = (rects[:, 2] > rects[:, 0]) & (rects[:, 3] > rects[:, 1])
+        boxes = rects[on_frame]
+        cores = _merge_boxes(boxes, halo, shape) if len(boxes) else boxes
+        extents = expand(cores, halo, h, w)
+
+        slot_boxes = np.full(len(rects), -1, np.intp)
+        for index in np.flatnonzero(on_frame):
+            x0, y0, x1, y1 = rects[index]
+            inside = (cores[:, 0] <= x0) & (cores[:, 1] <= y0) & (cores[:, 2] >= x1) & (cores[:, 3] >= y1)
+            slot_boxes[index] = np.argmax(inside)
+
+        plan = cls((h, w), cores, extents, slot_boxes, False)
+        plan.full_frame = plan.area() >= ROI_MAX_COVERAGE * h * w
+        return plan
+
+    def area(self, boxes=None) -> int:
+        extents = self.extents if boxes is None else self.extents[boxes]
+        return int(((extents[:, 2] - extents[:, 0]) * (extents[:, 3] - extents[:, 1])).sum())
+
+    @property
+    def coverage(self) -> float:
+        return self.area() / (self.shape[0] * self.shape[1])
+
+    def boxes_for(self, slots: np.ndarray) -> np.ndarray:
+        """Boolean mask of the boxes holding any of the selected slots"""
+        selected = np.zeros(len(self.cores), bool)
+        indices = self.slot_boxes[slots]
+        selected[indices[indices >= 0]] = True
+        return selected
+
+
+def preprocess_rois(img, plan: RoiPlan, boxes=None):
+    """Binarize only the slot regions of a frame (or the subset selected by `boxes`).
+
+    Pixels inside the processed cores are bit-identical to preprocess(img);
+    everything else is left at zero.
+    """
+    h, w = plan.shape
+    if boxes is None:
+        if plan.full_frame:
+            return preprocess(img)
+        boxes = np.ones(len(plan.cores), bool)
+    elif plan.area(boxes) >= ROI_MAX_COVERAGE * h * w:
+        return preprocess(img)
+    out = np.zeros(plan.shape, np.uint8)
+    for (cx0, cy0, cx1, cy1), (ex0, ey0, ex1, ey1) in zip(plan.cores[boxes].tolist(), plan.extents[boxes].tolist()):
+        binary = preprocess(img[ey0:ey1, ex0:ex1])
+        out[cy0:cy1, cx0:cx1] = binary[cy0 - ey0:cy1 - ey0, cx0 - ex0:cx1 - ex0]
+    return out
+
+
+class Preprocessor:
+    """A lot's binarization with its ROI plan and every intermediate image preallocated.
+
+    Buffers are built for the first frame size seen (and rebuilt only if it
+    changes), so steady-state frames allocate no image memory. The returned
+    binary frame is owned by the preprocessor and overwritten on the next call.
+    """
+
+    def __init__(self, geometry: SlotGeometry, roi: bool = True, timer=NULL_TIMER):
+        self.geometry = geometry
+        self.roi = roi
+        self.timer = timer
+        self.shape = None
+        self.plan = None
+        self.full = None
+        self.box_buffers = []
+        self.out = None
+        self.written = None
+
+    def prepare(self, shape):
+        h, w = shape[:2]
+        self.shape = (h, w)
+        self.full = StageBuffers(shape)
+        self.plan = RoiPlan.build(self.geometry, shape) if self.roi else None
+        if self.plan is not None and not self.plan.full_frame:
+            self.box_buffers = [StageBuffers((ey1 - ey0, ex1 - ex0))
+                                for ex0, ey0, ex1, ey1 in self.plan.extents.tolist()]
+            self.out = np.zeros((h, w), np.uint8)
+            self.written = np.zeros(len(self.plan.cores), bool)
+
+    def __call__(self, img, boxes=None):
+        """Binary frame for `img`; with a `boxes` mask only those ROI cores are refreshed"""
+        if self.shape != img.shape[:2]:
+            self.prepare(img.shape)
+        plan = self.plan
+        if plan is None or plan.full_frame:
+            return preprocess(img, self.full, self.timer)
+        if boxes is None:
+            boxes = np.ones(len(plan.cores), bool)
+        elif plan.area(boxes) >= ROI_MAX_COVERAGE * self.shape[0] * self.shape[1]:
+            return preprocess(img, self.full, self.timer)
+
+        out = self.out
+        # Cores filled on an earlier call but not this one go back to zero
+        for index in np.flatnonzero(self.written & ~boxes).tolist():
+            cx0, cy0, cx1, cy1 = plan.cores[index].tolist()
+            out[cy0:cy1, cx0:cx1] = 0
+        for index in np.flatnonzero(boxes).tolist():
+            cx0, cy0, cx1, cy1 = plan.cores[index].tolist()
+            ex0, ey0, ex1, ey1 = plan.extents[index].tolist()
+            binary = preprocess(img[ey0:ey1, ex0:ex1], self.box_buffers[index], self.timer)
+            out[cy0:cy1, cx0:cx1] = binary[cy0 - ey0:cy1 - ey0, cx0 - ex0:cx1 - ex0]
+            self.timer.lap("roi_copy")
+        self.written = boxes
+        return out
@@ -0,0 +1,124 @@
+import os
+import pickle
+import argparse
+import logging
+import cv2
+import numpy as np
+from app.detection.occupancy import SlotGeometry
+
+logger = logging.getLogger(__name__)
+
+# One int32 row per slot; 0 in w, h or threshold means "use the lot's default"
+SLOT_COLUMNS = ("x", "y", "w", "h", "threshold")
+ARRAY_EXTENSIONS = (".npy", ".npz")
+NPZ_KEY = "slots"
+
+
+class _PlainUnpickler(pickle.Unpickler):
+    """Unpickles lists, tuples and numbers only; anything that names a class is rejected"""
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Position files may not reference {module}.{name}")
+
+
+def read_legacy(path: str) -> np.ndarray:
+    with open(path, 'rb') as f:
+        positions = _PlainUnpickler(f).load()
+    slots = np.zeros((len(positions), len(SLOT_COLUMNS)), np.int32)
+    if len(positions):
+        slots[:, :2] = np.asarray(positions, np.int64)[:, :2]
+    return slots
+
+
+def validate(slots: np.ndarray, path: str = "") -> np.ndarray:
+    """Check the array layout and value ranges of a slot table"""
+    if slots.ndim != 2 or slots.shape[1] != len(SLOT_COLUMNS):
+        raise ValueError(f"{path}: expected an (N, {len(SLOT_COLUMNS)}) array of {SLOT_COLUMNS}, got {slots.shape}")
+    if not np.issubdtype(slots.dtype, np.integer):
+        raise ValueError(f"{path}: slot table must be integer, got {slots.dtype}")
+    negative = np.flatnonzero((slots[:, 2:] < 0).any(axis=1))
+    if len(negative):
+        raise ValueError(f"{path}: negative size or threshold in slots {negative[:10].tolist()}")
+    return slots
+
+
+def load_slots(path: str, mmap: bool = True) -> np.ndarray:
+    """(N, 5) slot table from a .npy (memory-mapped), .npz or legacy pickle file"""
+    if path.endswith(".npy"):
+        slots = np.load(path, mmap_mode="r" if mmap else None, allow_pickle=False)
+    elif path.endswith(".npz"):
+        with np.load(path, allow_pickle=False) as data:
+            slots = data[NPZ_KEY]
+    else:
+        logger.warning(f"Loading pickled positions from {path}; convert with python -m app.detection.positions")
+        slots = read_legacy(path)
+    return validate(slots, path)
+
+
+def save_slots(path: str, slots: np.ndarray):
+    slots = validate(np.ascontiguousarray(slots, np.int32), path)
+    if path.endswith(".npz"):
+        np.savez_compressed(path, **{NPZ_KEY: slots})
+    else:
+        np.save(path, slots, allow_pickle=False)
+
+
+def off_frame(rois: np.ndarray, shape) -> np.ndarray:
+    """Indices of slots (x0, y0, x1, y1) that do not lie entirely inside a frame of the given shape"""
+    h, w = shape[:2]
+    return np.flatnonzero((rois[:, 0] < 0) | (rois[:, 1] < 0) | (rois[:, 2] > w) | (rois[:, 3] > h))
+
+
+def frame_shape(config):
+    """Frame size the lot's positions are recorded against: the source's first frame at positions_scale"""
+    cap = cv2.VideoCapture(config.resolve(config.video_source))
+    success, img = cap.read()
+    cap.release()
+    if not success:
+        return None
+    scale = config.scale if config.positions_scale is None else config.positions_scale
+    return int(img.shape[0] * scale), int(img.shape[1] * scale)
+
+
+def convert_lot(config) -> str:
+    """Write a lot's pickled positions next to it as .npy, checked against its video; returns the new path"""
+    source = config.resolve(config.positions_path)
+    target = os.path.splitext(source)[0] + ".npy"
+    slots = read_legacy(source)
+    shape = frame_shape(config)
+    if shape is not None:
+        sizes = np.where(slots[:, 2:4] > 0, slots[:, 2:4], (config.width, config.height))
+        rois = SlotGeometry.from_slots(np.column_stack((slots[:, :2], sizes))).rois
+        outside = off_frame(rois, shape)
+        if len(outside):
+            raise ValueError(f"{config.name}: slots {outside.tolist()} extend past the {shape[1]}x{shape[0]} frame")
+    else:
+        logger.warning(f"{config.name}: video unavailable, positions not checked against the frame")
+    save_slots(target, slots)
+    return target
+
+
+def main():
+    from app.detection.detector import SCRIPTS_DIR
+    from app.detection.registry import registry
+
+    parser = argparse.ArgumentParser(description="Convert pickled slot positions to .npy")
+    parser.add_argument('lots', nargs='*', help='Parking lot IDs to convert')
+    parser.add_argument('--all', action='store_true', help='Convert every lot whose positions are still pickled')
+    args = parser.parse_args()
+
+    ids = registry.ids() if args.all else args.lots
+    for parking_id in ids:
+        config = registry.get(parking_id)
+        if config is None:
+            parser.error(f"Unknown parking lot ID: {parking_id}")
+        if config.positions_path.endswith(ARRAY_EXTENSIONS):
+            continue
+        target = convert_lot(config)
+        print(f"{config.name}: {len(load_slots(target))} slots -> "
+              f"\"positions_path\": \"{os.path.relpath(target, SCRIPTS_DIR)}\"")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+import logging
+from dataclasses import fields
+from app.detection.detector import LotConfig
+
+logger = logging.getLogger(__name__)
+
+LOTS_CONFIG_PATH = os.getenv(
+    "LOTS_CONFIG_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "lots.json")
+)
+LOTS_RELOAD_INTERVAL = float(os.getenv("LOTS_RELOAD_INTERVAL", "5"))
+
+_CONFIG_FIELDS = {f.name for f in fields(LotConfig) if f.init and f.name != "geometry"}
+
+
+def parse_lot(entry: dict) -> LotConfig:
+    unknown = set(entry) - _CONFIG_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown lot settings for {entry.get('parking_id')}: {sorted(unknown)}")
+    config = LotConfig(**entry)
+    config.load_geometry()
+    return config
+
+
+class LotRegistry:
+    """Parking lots loaded from a JSON file; reloading swaps the whole table atomically"""
+
+    def __init__(self, path: str = LOTS_CONFIG_PATH):
+        self.path = path
+        self._lots = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop_event = threading.Event()
+
+    def load(self):
+        """Parse the registry file and precompute slot geometry; keeps the old table on error"""
+        with self._lock:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path) as f:
+                data = json.load(f)
+
+            lots = {}
+            for entry in data.get("lots", []):
+                config = parse_lot(entry)
+                if config.parking_id in lots:
+                    raise ValueError(f"Duplicate parking lot ID: {config.parking_id}")
+                lots[config.parking_id] = config
+
+            self._lots = lots
+            self._mtime = mtime
+            logger.info(f"Loaded {len(lots)} parking lots from {self.path}")
+            return lots
+
+    def reload_if_changed(self) -> bool:
+        try:
+            if os.path.getmtime(self.path) == self._mtime:
+                return False
+            self.load()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to reload parking lots from {self.path}: {e}")
+            return False
+
+    def start_watching(self, interval: float = LOTS_RELOAD_INTERVAL):
+        """Poll the registry file for changes so lots can be added without restarting uvicorn"""
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop_event.wait(interval):
+                self.reload_if_changed()
+
+        self._stop_event.clear()
+        self._watcher = threading.Thread(target=watch, name="lot-registry-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop_event.set()
+        self._watcher = None
+
+    def get(self, parking_id: str):
+        return self._lots.get(parking_id)
+
+    def ids(self):
+        return list(self._lots)
+
+    def __contains__(self, parking_id: str):
+        return parking_id in self._lots
+
+    def __len__(self):
+        return len(self._lots)
+
+
+registry = LotRegistry()
+registry.load()
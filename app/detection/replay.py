@@ -0,0 +1,240 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import logging
+import dataclasses
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from app.detection.detector import LotConfig, ParkingDetector
+from app.detection.occupancy import occupancy_batch
+from app.detection.pipeline import Preprocessor
+from app.detection.sources import VideoFileSource, open_source
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+TIMELINE_FIELDS = ("time", "frame", "slot", "count", "occupied")
+FORMATS = ("csv", "ndjson", "parquet")
+# Media time replayed (and discarded) ahead of each chunk so its detector state has settled by the chunk's first frame
+DEFAULT_OVERLAP = 10.0
+
+
+def replay_config(config: LotConfig, every_frame: bool = False) -> LotConfig:
+    """The lot's settings for offline replay: inline decoding, no looping and no update throttling"""
+    overrides = dict(prefetch_frames=0, end_policy="stop", min_update_interval=0.0)
+    if every_frame:
+        overrides.update(detect_hz=0, motion_gating=False)
+    return dataclasses.replace(config, **overrides)
+
+
+def open_at(config: LotConfig, first: int):
+    if first:
+        return VideoFileSource(config.resolve(config.video_source), scale=config.scale, start=first)
+    return open_source(config)
+
+
+def replay(config: LotConfig, start: int = 0, stop: int = None, warmup: int = 0, changes_only: bool = False,
+           batch: int = 0, window: int = 1):
+    """Run frames [start, stop) of a lot's video through its detector as fast as they decode.
+
+    Returns timeline rows (time, frame, slot, count, occupied) for every detection,
+    or with changes_only only for slots whose debounced state changed. `warmup`
+    frames before `start` are processed first, without rows, to build up state.
+    With `batch`, see replay_batched.
+    """
+    first = max(0, start - warmup)
+    if batch:
+        return replay_batched(config, first, start, stop, changes_only, batch, window)
+    source = open_at(config, first)
+    detector = ParkingDetector(config, notify=lambda parking_id, free_slots: None)
+    rows = []
+    previous = None
+    frame_index = first
+    try:
+        while stop is None or frame_index < stop:
+            frame = source.read()
+            if frame is None:
+                break
+            img, timestamp = frame
+            detections = detector.detections
+            detector.process(img, timestamp, render=False)
+            if detector.detections != detections and frame_index >= start:
+                occupied = detector.prev_parking_status
+                if changes_only and previous is not None:
+                    slots = (occupied != previous).nonzero()[0].tolist()
+                else:
+                    slots = range(len(occupied))
+                counts = detector.counts
+                for slot in slots:
+                    rows.append((round(timestamp, 3), frame_index, slot, int(counts[slot]), bool(occupied[slot])))
+                previous = occupied.copy()
+            frame_index += 1
+    finally:
+        source.close()
+    return rows
+
+
+def replay_batched(config: LotConfig, first: int, start: int, stop, changes_only: bool, batch: int, window: int):
+    """Every frame's occupancy, binarized into a stack of `batch` frames and counted and smoothed one stack at a time.
+
+    There is no cadence, motion gating or debouncing here: a slot's state is
+    the majority vote of its thresholded readings over the last `window` frames.
+    """
+    geometry = config.load_geometry()
+    preprocessor = Preprocessor(geometry, config.roi_preprocess)
+    source = open_at(config, first)
+    stack = None
+    frames = []
+    history = None
+    previous = None
+    rows = []
+
+    def flush():
+        nonlocal history, previous
+        counts, occupied, smoothed = occupancy_batch(stack[:len(frames)], geometry, geometry.thresholds,
+                                                     window, history)
+        if window > 1:
+            history = occupied if history is None else np.concatenate((history, occupied))
+            history = history[-(window - 1):]
+        for (frame_index, timestamp), frame_counts, state in zip(frames, counts.tolist(), smoothed):
+            if frame_index < start:
+                continue
+            if changes_only and previous is not None:
+                slots = (state != previous).nonzero()[0].tolist()
+            else:
+                slots = range(len(state))
+            for slot in slots:
+                rows.append((round(timestamp, 3), frame_index, slot, frame_counts[slot], bool(state[slot])))
+            previous = state
+        frames.clear()
+
+    frame_index = first
+    try:
+        while stop is None or frame_index < stop:
+            frame = source.read()
+            if frame is None:
+                break
+            img, timestamp = frame
+            binary = preprocessor(img)
+            if stack is None:
+                stack = np.empty((batch,) + binary.shape, np.uint8)
+            np.copyto(stack[len(frames)], binary)
+            frames.append((frame_index, timestamp))
+            if len(frames) == batch:
+                flush()
+            frame_index += 1
+        if frames:
+            flush()
+    finally:
+        source.close()
+    return rows
+
+
+def chunk_bounds(n_frames: int, chunks: int):
+    edges = [n_frames * index // chunks for index in range(chunks + 1)]
+    return [(lo, hi) for lo, hi in zip(edges, edges[1:]) if hi > lo]
+
+
+def _replay_chunk(args):
+    return replay(*args)
+
+
+def replay_parallel(config: LotConfig, workers: int, overlap: float = DEFAULT_OVERLAP, changes_only: bool = False,
+                    batch: int = 0, window: int = 1):
+    """Split a video file into one chunk per worker and replay the chunks in a process pool, in order"""
+    path = config.resolve(config.video_source)
+    if workers <= 1 or not os.path.isfile(path):
+        return replay(config, changes_only=changes_only, batch=batch, window=window)
+    probe = VideoFileSource(path)
+    n_frames, fps = probe.frame_count, probe.fps
+    probe.close()
+    if n_frames <= 0:
+        logger.warning(f"[{config.name}] Frame count unknown; replaying in one process")
+        return replay(config, changes_only=changes_only, batch=batch, window=window)
+
+    warmup = int(overlap * fps)
+    jobs = [(config, start, stop, warmup, changes_only, batch, window) for start, stop in chunk_bounds(n_frames, workers)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = list(pool.map(_replay_chunk, jobs))
+    if not changes_only:
+        return [row for chunk in chunks for row in chunk]
+    # Each chunk lists every slot at its first detection; keep only real changes across chunk boundaries
+    rows = []
+    state = {}
+    for row in (row for chunk in chunks for row in chunk):
+        if state.get(row[2]) != row[4]:
+            state[row[2]] = row[4]
+            rows.append(row)
+    return rows
+
+
+def write_timeline(rows, path: str, fmt: str):
+    if fmt == "parquet":
+        columns = list(zip(*rows)) if rows else [[] for _ in TIMELINE_FIELDS]
+        table = pyarrow.table({name: list(values) for name, values in zip(TIMELINE_FIELDS, columns)})
+        pyarrow.parquet.write_table(table, path)
+        return
+    f = sys.stdout if path == "-" else open(path, "w", newline="")
+    try:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(TIMELINE_FIELDS)
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(TIMELINE_FIELDS, row))) + "\n")
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def main():
+    from app.detection.registry import registry
+
+    parser = argparse.ArgumentParser(description="Replay a lot's recording without pacing and write its occupancy timeline")
+    parser.add_argument('lot', help='Parking lot ID or name')
+    parser.add_argument('--video', help="Recording to replay instead of the lot's video_source")
+    parser.add_argument('--output', '-o', default='-', help='Timeline file ("-" for stdout, the default)')
+    parser.add_argument('--format', choices=FORMATS, help='Timeline format (default: from the file extension, else csv)')
+    parser.add_argument('--workers', type=int, default=1, help='Processes to split a video file across')
+    parser.add_argument('--overlap', type=float, default=DEFAULT_OVERLAP,
+                        help='Seconds replayed ahead of each chunk to settle its state')
+    parser.add_argument('--changes', action='store_true', help='Only write rows where a slot changed state')
+    parser.add_argument('--every-frame', action='store_true',
+                        help='Detect every slot on every frame (no cadence or motion gating)')
+    parser.add_argument('--batch', type=int, default=0,
+                        help='Count occupancy this many frames at a time, smoothed by --smooth instead of debouncing')
+    parser.add_argument('--smooth', type=int, default=1, help='Majority-vote window in frames for --batch')
+    args = parser.parse_args()
+
+    names = {registry.get(parking_id).name: parking_id for parking_id in registry.ids()}
+    config = registry.get(names.get(args.lot, args.lot))
+    if config is None:
+        parser.error(f"Unknown parking lot: {args.lot}")
+    if args.video:
+        config = dataclasses.replace(config, video_source=os.path.abspath(args.video))
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip(".").replace("jsonl", "ndjson")
+    if fmt not in FORMATS:
+        fmt = "csv"
+    if fmt == "parquet" and (pyarrow is None or args.output == "-"):
+        parser.error("Parquet output needs pyarrow installed and an --output file")
+
+    start = time.perf_counter()
+    rows = replay_parallel(replay_config(config, args.every_frame), args.workers, args.overlap, args.changes,
+                           args.batch, args.smooth)
+    elapsed = time.perf_counter() - start
+    write_timeline(rows, args.output, fmt)
+    print(f"[{config.name}] {len(rows)} timeline rows in {elapsed:.1f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
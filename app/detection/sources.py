@@ -0,0 +1,337 @@
+import os
+import time
+import threading
+import logging
+from collections import deque
+from typing import Optional, Tuple
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+LIVE_SCHEMES = ("rtsp://", "rtsps://", "rtmp://", "http://", "https://")
+DEFAULT_FPS = 25.0
+# A dropped camera stream is reopened this many times, waiting RECONNECT_DELAY seconds (doubling) before each try
+RECONNECT_ATTEMPTS = 5
+RECONNECT_DELAY = 1.0
+
+# A frame and its media time in seconds
+Frame = Tuple[np.ndarray, float]
+
+# cv2.imread flags that decode a JPEG directly at 1/2, 1/4 or 1/8 resolution
+REDUCED_DECODE = {0.5: cv2.IMREAD_REDUCED_COLOR_2, 0.25: cv2.IMREAD_REDUCED_COLOR_4, 0.125: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def is_live(path: str) -> bool:
+    return path.lower().startswith(LIVE_SCHEMES)
+
+
+def scaled_size(shape, scale: float):
+    return int(shape[1] * scale), int(shape[0] * scale)
+
+
+def rescaleframe(frame, scale=0.5):
+    return cv2.resize(frame, scaled_size(frame.shape, scale), interpolation=cv2.INTER_AREA)
+
+
+class FrameSource:
+    """Where a lot's frames come from. read() returns the next (image, media time), or None at the end.
+
+    Frames come out at the lot's processing resolution (`scale` of the decoded size).
+    """
+
+    live = False
+    fps = DEFAULT_FPS
+    scale = 1.0
+    dropped = 0  # frames decoded but skipped without being read
+
+    def read(self) -> Optional[Frame]:
+        raise NotImplementedError
+
+    def skip(self, count: int) -> int:
+        """Advance past up to `count` frames as cheaply as the source allows; returns how many were skipped"""
+        for skipped in range(count):
+            if self.read() is None:
+                return skipped
+        return count
+
+    def interrupt(self):
+        """Ask a read() blocked on another thread to give up; the source is still closed separately"""
+
+    def close(self):
+        pass
+
+
+class CaptureSource(FrameSource):
+    """Common cv2.VideoCapture handling; scaled sources decode into one reused full-size buffer"""
+
+    def __init__(self, cap, scale: float = 1.0):
+        self.cap = cap
+        self.scale = scale
+        self._decoded = None
+
+    def grab(self):
+        if self.scale == 1.0:
+            # Unscaled frames are handed downstream (and may sit in the prefetch buffer), so each needs its own array
+            success, img = self.cap.read()
+            return img if success else None
+        success, img = self.cap.read(self._decoded)
+        if not success:
+            return None
+        self._decoded = img
+        return cv2.resize(img, scaled_size(img.shape, self.scale), interpolation=cv2.INTER_AREA)
+
+    def close(self):
+        self.cap.release()
+
+
+class VideoFileSource(CaptureSource):
+    """A local video file, optionally looping back to its first frame at the end or starting part-way in"""
+
+    def __init__(self, path: str, loop: bool = False, scale: float = 1.0, start: int = 0):
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise FileNotFoundError(f"Cannot open video file: {path}")
+        super().__init__(cap, scale)
+        self.path = path
+        self.loop = loop
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps > 0 else DEFAULT_FPS
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.index = 0
+        if start > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            self.index = start
+
+    def read(self) -> Optional[Frame]:
+        img = self.grab()
+        if img is None and self.loop and self.index > 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            img = self.grab()
+        if img is None:
+            return None
+        # Media time keeps increasing across loops so cadence and debouncing stay monotonic
+        timestamp = self.index / self.fps
+        self.index += 1
+        return img, timestamp
+
+    def skip(self, count: int) -> int:
+        # grab() without retrieve() leaves out the colour conversion and resize
+        for skipped in range(count):
+            if not self.cap.grab():
+                if not (self.loop and self.index > 0):
+                    return skipped
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                if not self.cap.grab():
+                    return skipped
+            self.index += 1
+        return count
+
+
+class StreamSource(CaptureSource):
+    """An RTSP/HTTP camera; frames are stamped with arrival time and the source paces itself.
+
+    A camera never ends: when the stream drops it is reopened with backoff, and
+    read() raises IOError once RECONNECT_ATTEMPTS reopens have failed.
+    """
+
+    live = True
+
+    def __init__(self, url: str, scale: float = 1.0):
+        cap = self.open(url)
+        if not cap.isOpened():
+            raise FileNotFoundError(f"Cannot open camera stream: {url}")
+        super().__init__(cap, scale)
+        self.url = url
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if 0 < fps <= 120 else DEFAULT_FPS
+        self.started = time.monotonic()
+        self._interrupted = threading.Event()
+        logger.info(f"Opened camera stream {url} at {self.fps:g} fps")
+
+    @staticmethod
+    def open(url: str):
+        cap = cv2.VideoCapture(url)
+        # Keep the driver's own queue short; freshness is handled by the prefetch buffer
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def read(self) -> Optional[Frame]:
+        img = self.grab()
+        attempt = 0
+        while img is None:
+            if attempt == RECONNECT_ATTEMPTS:
+                raise IOError(f"Camera stream {self.url} dropped and could not be reopened")
+            delay = RECONNECT_DELAY * 2 ** attempt
+            attempt += 1
+            logger.warning(f"Camera stream {self.url} dropped; reconnecting in {delay:g}s "
+                           f"({attempt}/{RECONNECT_ATTEMPTS})")
+            if self._interrupted.wait(delay):
+                return None
+            self.cap.release()
+            self.cap = self.open(self.url)
+            self._decoded = None
+            if self.cap.isOpened():
+                img = self.grab()
+        if attempt:
+            logger.info(f"Camera stream {self.url} reconnected")
+        # Arrival time keeps increasing across reconnects, so cadence and debouncing stay monotonic
+        return img, time.monotonic() - self.started
+
+    def interrupt(self):
+        self._interrupted.set()
+
+
+class ImageDirectorySource(FrameSource):
+    """Still images in a directory, read in name order at a fixed frame rate"""
+
+    def __init__(self, path: str, fps: Optional[float] = None, loop: bool = False, scale: float = 1.0):
+        self.files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.files:
+            raise FileNotFoundError(f"No images in {path}")
+        self.fps = fps or DEFAULT_FPS
+        self.loop = loop
+        self.scale = scale
+        self.index = 0
+
+    def load(self, path: str):
+        flag = REDUCED_DECODE.get(self.scale)
+        if flag is not None:
+            # The JPEG decoder skips the detail we'd throw away (sizes round up rather than down)
+            return cv2.imread(path, flag)
+        img = cv2.imread(path)
+        if img is None or self.scale == 1.0:
+            return img
+        return rescaleframe(img, self.scale)
+
+    def read(self) -> Optional[Frame]:
+        position = self.index
+        if position >= len(self.files):
+            if not self.loop:
+                return None
+            position %= len(self.files)
+        img = self.load(self.files[position])
+        if img is None:
+            raise IOError(f"Cannot read image {self.files[position]}")
+        timestamp = self.index / self.fps
+        self.index += 1
+        return img, timestamp
+
+    def skip(self, count: int) -> int:
+        # Skipped images are never read from disk
+        if not self.loop:
+            count = max(0, min(count, len(self.files) - self.index))
+        self.index += count
+        return count
+
+
+class PrefetchReader(FrameSource):
+    """Decodes a source on its own thread into a bounded ring buffer.
+
+    For files the decoder blocks when the buffer is full, so no frame is lost.
+    With drop_stale (the default for live sources) the oldest frame is
+    overwritten instead, and read() skips to the newest one so detection
+    always works on the freshest frame.
+    """
+
+    def __init__(self, source: FrameSource, capacity: int = 4, drop_stale: Optional[bool] = None):
+        self.source = source
+        self.live = source.live
+        self.fps = source.fps
+        self.scale = source.scale
+        self.drop_stale = source.live if drop_stale is None else drop_stale
+        self.capacity = max(1, capacity)
+        self.dropped = 0
+        self._skip = 0
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._ended = False
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._decode, name="frame-prefetch", daemon=True)
+        self._thread.start()
+
+    def _decode(self):
+        try:
+            while not self._closed:
+                with self._cond:
+                    skip, self._skip = self._skip, 0
+                if skip:
+                    self.source.skip(skip)
+                frame = self.source.read()
+                with self._cond:
+                    if frame is None:
+                        break
+                    if self.drop_stale:
+                        if len(self._buffer) >= self.capacity:
+                            self._buffer.popleft()
+                            self.dropped += 1
+                    else:
+                        self._cond.wait_for(lambda: self._closed or len(self._buffer) < self.capacity)
+                    self._buffer.append(frame)
+                    self._cond.notify_all()
+        except Exception as e:
+            self._error = e
+        finally:
+            # Released here rather than in close(): a stalled read may outlive close()'s join,
+            # and a VideoCapture must not be released while a read is still running on it
+            self.source.close()
+            with self._cond:
+                self._ended = True
+                self._cond.notify_all()
+
+    def read(self) -> Optional[Frame]:
+        with self._cond:
+            self._cond.wait_for(lambda: self._buffer or self._ended or self._closed)
+            if not self._buffer:
+                if self._error is not None:
+                    raise self._error
+                return None
+            if self.drop_stale and len(self._buffer) > 1:
+                self.dropped += len(self._buffer) - 1
+                frame = self._buffer.pop()
+                self._buffer.clear()
+            else:
+                frame = self._buffer.popleft()
+            self._cond.notify_all()
+            return frame
+
+    def skip(self, count: int) -> int:
+        """Discard decoded frames first; the decoder skips the rest without converting them. Never waits"""
+        with self._cond:
+            buffered = min(count, len(self._buffer))
+            for _ in range(buffered):
+                self._buffer.popleft()
+            self._skip += count - buffered
+            self._cond.notify_all()
+        return count
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._buffer.clear()
+            self._cond.notify_all()
+        self.source.interrupt()
+        self._thread.join(timeout=2)
+
+
+def open_source(config) -> FrameSource:
+    """Open a lot's video_source: camera URL, image directory or video file, prefetched when configured.
+
+    Scaling to the lot's processing resolution happens here, on the decode thread when prefetching.
+    """
+    path = config.resolve(config.video_source)
+    loop = config.end_policy == "loop"
+    if is_live(path):
+        source = StreamSource(path, scale=config.scale)
+    elif os.path.isdir(path):
+        source = ImageDirectorySource(path, config.source_fps, loop=loop, scale=config.scale)
+    else:
+        source = VideoFileSource(path, loop=loop, scale=config.scale)
+    if config.prefetch_frames > 0:
+        return PrefetchReader(source, config.prefetch_frames, config.drop_stale)
+    return source
@@ -0,0 +1,406 @@
+import os
+import time
+import logging
+import threading
+import itertools
+import multiprocessing
+from typing import Callable, Optional
+from app.detection.detector import LotConfig, RunStats, run_lot
+from app.detection.sources import is_live
+from app.utils.notifier import send_slot_update
+from app.utils.metrics import drain_metrics, merge_metrics
+
+logger = logging.getLogger(__name__)
+
+# 0 keeps detection in threads of the API process; "auto" sizes the pool to the usable CPUs
+DETECTION_WORKERS = os.getenv("DETECTION_WORKERS", "0")
+DETECTION_PIN_CORES = os.getenv("DETECTION_PIN_CORES", "false").lower() in ("1", "true", "yes")
+REBALANCE_INTERVAL = float(os.getenv("DETECTION_REBALANCE_INTERVAL", "30"))
+COST_REPORT_INTERVAL = 2.0
+# A lot is only migrated when it narrows the gap between busiest and idlest worker by this many cores
+REBALANCE_MIN_GAIN = 0.1
+DEFAULT_LOT_LOAD = 0.1
+
+
+def usable_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def pool_size() -> int:
+    if DETECTION_WORKERS == "auto":
+        return len(usable_cpus())
+    return max(0, int(DETECTION_WORKERS))
+
+
+class ThreadRun:
+    """A lot's detector running in a thread of this process"""
+
+    def __init__(self, config: LotConfig, on_frame=None, on_exit=None, streaming: bool = True):
+        self.config = config
+        self._stop_event = threading.Event()
+        self._streaming = threading.Event()
+        if streaming:
+            self._streaming.set()
+        self._thread = threading.Thread(
+            target=self._run, args=(on_frame, on_exit),
+            name=f"detect-{config.name}", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, on_frame, on_exit):
+        error = None
+        try:
+            run_lot(self.config, on_frame=on_frame, stop_event=self._stop_event, streaming=self._streaming)
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Detector failed for {self.config.parking_id}: {e}")
+        finally:
+            if on_exit is not None:
+                on_exit(error)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def set_streaming(self, streaming: bool):
+        """Switch JPEG encoding on or off without restarting the detector"""
+        if streaming:
+            self._streaming.set()
+        else:
+            self._streaming.clear()
+
+
+def worker_main(index: int, conn, core: Optional[int]):
+    """Entry point of a pool process: runs the lots it is told to, reports frames, updates and load"""
+    logging.basicConfig(level=logging.INFO)
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {core})
+    send_lock = threading.Lock()
+    runs = {}
+
+    def send(message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+
+    def send_frame(run_id, payload):
+        # The JPEG follows its header as raw bytes, so it is never pickled
+        with send_lock:
+            try:
+                conn.send(("frame", run_id, None))
+                conn.send_bytes(payload)
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+
+    def run(run_id, config, streaming, stop_event, stats):
+        error = None
+        try:
+            run_lot(
+                config,
+                on_frame=lambda payload: send_frame(run_id, payload),
+                stop_event=stop_event,
+                notify=lambda parking_id, free_slots: send(("update", parking_id, free_slots)),
+                stats=stats,
+                streaming=streaming,
+            )
+        except Exception as e:
+            error = str(e)
+        finally:
+            runs.pop(run_id, None)
+            send(("exit", run_id, error))
+
+    def report():
+        last = {}
+        while True:
+            time.sleep(COST_REPORT_INTERVAL)
+            for run_id, (_, _, stats) in list(runs.items()):
+                busy = stats.busy_seconds
+                send(("load", run_id, (busy - last.get(run_id, 0.0)) / COST_REPORT_INTERVAL))
+                last[run_id] = busy
+            # Metrics live in the API process; ship what this worker recorded since the last report
+            snapshot = drain_metrics()
+            if snapshot:
+                send(("metrics", None, snapshot))
+
+    threading.Thread(target=report, daemon=True).start()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        command = message[0]
+        if command == "start":
+            _, run_id, config, stream = message
+            stop_event, streaming, stats = threading.Event(), threading.Event(), RunStats()
+            if stream:
+                streaming.set()
+            runs[run_id] = (stop_event, streaming, stats)
+            threading.Thread(target=run, args=(run_id, config, streaming, stop_event, stats),
+                             name=f"detect-{config.name}", daemon=True).start()
+        elif command == "stop":
+            entry = runs.get(message[1])
+            if entry is not None:
+                entry[0].set()
+        elif command == "stream":
+            _, run_id, stream = message
+            entry = runs.get(run_id)
+            if entry is not None and stream:
+                entry[1].set()
+            elif entry is not None:
+                entry[1].clear()
+        elif command == "shutdown":
+            break
+    for stop_event, _, _ in list(runs.values()):
+        stop_event.set()
+
+
+class PoolRun:
+    """A lot's detector placed on a pool worker; survives migration and worker restarts"""
+
+    def __init__(self, supervisor, config: LotConfig, on_frame=None, on_exit=None, streaming: bool = True):
+        self.supervisor = supervisor
+        self.config = config
+        self.on_frame = on_frame
+        self.on_exit = on_exit
+        self.streaming = streaming and on_frame is not None
+        self.run_id = None
+        self.worker = None
+        self.load = None
+        self.stopped = False
+        # Only a camera can move between workers: a restarted file or image run would play again from the start
+        self.movable = is_live(config.resolve(config.video_source))
+
+    def stop(self):
+        self.supervisor.stop(self)
+
+    def set_streaming(self, streaming: bool):
+        self.supervisor.set_streaming(self, streaming and self.on_frame is not None)
+
+
+class Worker:
+    def __init__(self, index: int, core: Optional[int]):
+        self.index = index
+        self.core = core
+        self.runs = {}
+        self._send_lock = threading.Lock()
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main, args=(index, child_conn, core),
+            name=f"detection-worker-{index}", daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    @property
+    def load(self) -> float:
+        return sum(run.load if run.load is not None else DEFAULT_LOT_LOAD for run in self.runs.values())
+
+    def send(self, message) -> bool:
+        with self._send_lock:
+            try:
+                self.conn.send(message)
+                return True
+            except (BrokenPipeError, EOFError, OSError):
+                return False
+
+
+class DetectionSupervisor:
+    """Fixed-size pool of detection processes that lots are scheduled onto.
+
+    Each lot goes to the worker with the lowest measured load (fraction of a
+    core spent in the lot's frame loop). Every REBALANCE_INTERVAL seconds a
+    camera lot is migrated from the busiest to the idlest worker when that
+    narrows the gap, and lots on a worker that dies are restarted on the pool.
+    """
+
+    def __init__(self, size: int, pin_cores: bool = DETECTION_PIN_CORES,
+                 notify: Callable[[str, int], None] = send_slot_update):
+        self.size = size
+        self.pin_cores = pin_cores
+        self.notify = notify
+        self._lock = threading.RLock()
+        self._ids = itertools.count()
+        self._closed = False
+        self._cores = usable_cpus()
+        self.workers = [self._spawn(index) for index in range(size)]
+        threading.Thread(target=self._rebalance_loop, name="detection-rebalance", daemon=True).start()
+
+    def _spawn(self, index: int) -> Worker:
+        core = self._cores[index % len(self._cores)] if self.pin_cores else None
+        worker = Worker(index, core)
+        threading.Thread(target=self._read, args=(worker,), name=f"detection-worker-{index}-reader",
+                         daemon=True).start()
+        logger.info(f"Started detection worker {index} (pid {worker.process.pid}, core {core})")
+        return worker
+
+    def start(self, config: LotConfig, on_frame=None, on_exit=None, streaming: bool = True) -> PoolRun:
+        run = PoolRun(self, config, on_frame, on_exit, streaming)
+        with self._lock:
+            self._place(run)
+        return run
+
+    def _place(self, run: PoolRun, exclude: Worker = None):
+        candidates = [worker for worker in self.workers if worker is not exclude] or self.workers
+        worker = min(candidates, key=lambda w: w.load)
+        run.run_id = f"{run.config.parking_id}-{next(self._ids)}"
+        run.worker = worker
+        worker.runs[run.run_id] = run
+        worker.send(("start", run.run_id, run.config, run.streaming))
+        logger.info(f"Scheduled {run.config.name} on detection worker {worker.index}")
+
+    def stop(self, run: PoolRun):
+        with self._lock:
+            run.stopped = True
+            worker = run.worker
+            if worker is not None and worker.runs.pop(run.run_id, None) is not None:
+                worker.send(("stop", run.run_id))
+
+    def set_streaming(self, run: PoolRun, streaming: bool):
+        with self._lock:
+            run.streaming = streaming
+            worker = run.worker
+            if worker is not None and run.run_id in worker.runs:
+                worker.send(("stream", run.run_id, streaming))
+
+    def _read(self, worker: Worker):
+        while True:
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            kind, key, value = message
+            if kind == "frame":
+                try:
+                    value = worker.conn.recv_bytes()
+                except (EOFError, OSError):
+                    break
+            if kind == "update":
+                self.notify(key, value)
+                continue
+            if kind == "metrics":
+                merge_metrics(value)
+                continue
+            run = worker.runs.get(key)
+            if run is None:
+                continue
+            if kind == "frame":
+                if run.on_frame is not None:
+                    run.on_frame(value)
+            elif kind == "load":
+                run.load = value
+            elif kind == "exit":
+                with self._lock:
+                    worker.runs.pop(key, None)
+                    run.stopped = True
+                if value:
+                    logger.error(f"Detector failed for {run.config.parking_id}: {value}")
+                if run.on_exit is not None:
+                    run.on_exit(value)
+        self._worker_died(worker)
+
+    def _worker_died(self, worker: Worker):
+        with self._lock:
+            if self._closed or self.workers[worker.index] is not worker:
+                return
+        # Reap and respawn without the lock, which stop() and start() take on the event loop
+        worker.process.join(timeout=1)
+        worker.conn.close()
+        logger.error(f"Detection worker {worker.index} exited (code {worker.process.exitcode}); restarting")
+        replacement = self._spawn(worker.index)
+        with self._lock:
+            if self._closed:
+                replacement.send(("shutdown", None))
+                return
+            # Runs placed on the dead worker meanwhile are in worker.runs too, so they move with the rest
+            orphans = list(worker.runs.values())
+            worker.runs.clear()
+            self.workers[worker.index] = replacement
+            for run in orphans:
+                self._place(run)
+
+    def _rebalance_loop(self):
+        while not self._closed:
+            time.sleep(REBALANCE_INTERVAL)
+            try:
+                self.rebalance()
+            except Exception as e:
+                logger.error(f"Rebalancing detection workers failed: {e}")
+
+    def rebalance(self):
+        """Move one camera lot from the busiest to the idlest worker if that narrows the load gap"""
+        with self._lock:
+            if len(self.workers) < 2:
+                return
+            busiest = max(self.workers, key=lambda w: w.load)
+            idlest = min(self.workers, key=lambda w: w.load)
+            gap = busiest.load - idlest.load
+            movable = [run for run in busiest.runs.values() if run.movable and run.load is not None]
+            if len(busiest.runs) < 2 or not movable:
+                return
+            # Moving load L turns the gap into |gap - 2L|; pick the lot that minimises it
+            run = min(movable, key=lambda r: abs(gap - 2 * r.load))
+            if gap - abs(gap - 2 * run.load) < REBALANCE_MIN_GAIN:
+                return
+            logger.info(f"Migrating {run.config.name} from worker {busiest.index} to worker {idlest.index}")
+            busiest.runs.pop(run.run_id, None)
+            busiest.send(("stop", run.run_id))
+            run.load = None
+            self._place(run, exclude=busiest)
+
+    def status(self):
+        with self._lock:
+            return [{
+                "worker": worker.index,
+                "pid": worker.process.pid,
+                "core": worker.core,
+                "load": round(worker.load, 3),
+                "lots": [run.config.parking_id for run in worker.runs.values()],
+            } for worker in self.workers]
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            workers = list(self.workers)
+        for worker in workers:
+            worker.send(("shutdown", None))
+        for worker in workers:
+            worker.process.join(timeout=3)
+            if worker.process.is_alive():
+                worker.process.kill()
+
+
+supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def start_pool():
+    """Spawn the detection worker pool if one is configured and not yet running.
+
+    The service calls this at startup so that worker processes are never spawned
+    on the event loop while it is serving requests.
+    """
+    global supervisor
+    with _supervisor_lock:
+        if supervisor is None and pool_size() > 0:
+            supervisor = DetectionSupervisor(pool_size())
+    return supervisor
+
+
+def start_run(config: LotConfig, on_frame=None, on_exit=None, streaming: bool = True):
+    """Start a lot's detector on the process pool when one is configured, otherwise in a thread.
+
+    With streaming=False the run only encodes frames once set_streaming(True) is called on it.
+    """
+    supervisor = start_pool()
+    if supervisor is not None:
+        return supervisor.start(config, on_frame, on_exit, streaming)
+    return ThreadRun(config, on_frame, on_exit, streaming)
+
+
+def shutdown():
+    if supervisor is not None:
+        supervisor.shutdown()
@@ -1,9 +1,13 @@
 from fastapi import FastAPI, HTTPException, Response
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import os
 import logging
-from app.detection.runner import run_detection_script, stream_video_and_detect
+from app.detection.runner import run_detection_script
+from app.detection.registry import registry
+from app.utils.metrics import lot_stats, render_prometheus, PROMETHEUS_CONTENT_TYPE
+from app.utils.notifier import notifier
+from app.detection.engine import get_lot_stream, stop_all_streams, stop_job, job_status, list_jobs
+from app.detection import supervisor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,19 +22,17 @@ app = FastAPI(
 @app.on_event("startup")
 async def startup_event():
     logger.info("ParkKar Detection Service starting up...")
-    logger.info(f"Available parking scripts: {len(PARKING_SCRIPTS)}")
+    logger.info(f"Available parking lots: {len(registry)}")
+    registry.start_watching()
+    supervisor.start_pool()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("ParkKar Detection Service shutting down...")
-
-# Map of parking lot IDs to script names
-PARKING_SCRIPTS = {
-    '5c88fa8cf4afda39709c2974': 'cb_parking_detector.py',
-    '5c88fa8cf4afda39709c2970': 'chemistry_parking_detector.py',
-    '661661e96104b67c07d092ec': 'workshop_parking_detector.py',
-    '68700289a320c9d36bd397a4': 'kbh_parking_detector.py',
-}
+    registry.stop_watching()
+    stop_all_streams()
+    supervisor.shutdown()
+    notifier.close()
 
 class SlotUpdatePayload(BaseModel):
     parkingId: str
@@ -48,7 +50,7 @@ def health_check():
             "status": "healthy", 
             "service": "parkkar-detection",
             "version": "1.0.0",
-            "parking_lots_available": len(PARKING_SCRIPTS)
+            "parking_lots_available": len(registry)
         }
     except Exception as e:
         logger.error(f"Health check failed: {e}")
@@ -57,37 +59,82 @@ def health_check():
 @app.get("/parking-lots")
 def get_parking_lots():
     return {
-        "parking_lots": list(PARKING_SCRIPTS.keys()),
-        "total": len(PARKING_SCRIPTS)
+        "parking_lots": registry.ids(),
+        "total": len(registry)
     }
 
+@app.post("/parking-lots/reload")
+def reload_parking_lots():
+    """Re-read the lot registry file without restarting the service"""
+    try:
+        registry.load()
+    except Exception as e:
+        logger.error(f"Failed to reload parking lots: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid lot registry: {e}")
+    return {"status": "reloaded", "total": len(registry)}
+
+@app.get("/stats")
+def get_stats():
+    """Per-lot detector counters (including how many slot evaluations motion gating skipped) and stream encode histograms"""
+    return {"lots": lot_stats()}
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus scrape endpoint: frame, stage, encode, viewer and notifier metrics per lot"""
+    return Response(render_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/workers")
+def get_workers():
+    """Detection pool placement and measured load per worker (empty when detection runs in-process)"""
+    pool = supervisor.supervisor
+    return {"workers": pool.status() if pool is not None else []}
+
 @app.get("/detect/{parking_id}")
 def run_detection(parking_id: str):
-    if parking_id not in PARKING_SCRIPTS:
+    """Start background detection for a lot; repeat calls return the job that is already running"""
+    config = registry.get(parking_id)
+    if config is None:
         raise HTTPException(status_code=404, detail="Invalid parking lot ID")
 
-    script_name = PARKING_SCRIPTS[parking_id]
-    script_path = os.path.join(os.path.dirname(__file__), "detection", "scripts", script_name)
-    run_detection_script(parking_id, script_path)
-    return {"status": "Detection started"}
+    job, created = run_detection_script(config)
+    return {"status": "Detection started" if created else "Detection already running", "job": job}
+
+@app.get("/jobs")
+def get_jobs():
+    return {"jobs": list_jobs()}
+
+@app.post("/jobs/{parking_id}/start")
+def start_detection_job(parking_id: str):
+    return run_detection(parking_id)
+
+@app.post("/jobs/{parking_id}/stop")
+def stop_detection_job(parking_id: str):
+    """Stop a lot's background job; the detector keeps running for any open streams"""
+    job = stop_job(parking_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No detection job for this parking lot")
+    return {"status": "Detection stopped", "job": job}
+
+@app.get("/jobs/{parking_id}")
+def get_job(parking_id: str):
+    job = job_status(parking_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No detection job for this parking lot")
+    return {"job": job}
 
 @app.get("/stream/{parking_id}")
-def stream_and_detect(parking_id: str):
-    """Stream video with real-time parking detection - optimized for low latency"""
-    if parking_id not in PARKING_SCRIPTS:
-        raise HTTPException(status_code=404, detail="Invalid parking lot ID")
+async def stream_and_detect(parking_id: str):
+    """Stream video with real-time parking detection - one shared detector per lot, fanned out to all viewers.
 
-    script_name = PARKING_SCRIPTS[parking_id]
-    script_path = os.path.join(os.path.dirname(__file__), "detection", "scripts", script_name)
-    
-    # Check if script file exists
-    if not os.path.exists(script_path):
-        logger.error(f"Detection script not found: {script_path}")
-        raise HTTPException(status_code=404, detail="Detection script not found")
+    Viewers are served by an async generator on the event loop, so they don't hold threadpool threads.
+    """
+    config = registry.get(parking_id)
+    if config is None:
+        raise HTTPException(status_code=404, detail="Invalid parking lot ID")
 
     try:
         return StreamingResponse(
-            stream_video_and_detect(parking_id, script_path),
+            get_lot_stream(config).frames(),
             media_type="multipart/x-mixed-replace; boundary=frame",
             headers={
                 "Cache-Control": "no-cache, no-store, must-revalidate",
@@ -0,0 +1,300 @@
+import time
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import accumulate
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter partitioned by label values, e.g. per parking lot"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=("lot",)):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] += amount
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def drain(self) -> dict:
+        """Take the counts accumulated so far, leaving the counter at zero"""
+        with self._lock:
+            values, self._values = dict(self._values), defaultdict(float)
+        return values
+
+    def merge(self, values: dict):
+        with self._lock:
+            for labels, value in values.items():
+                self._values[labels] += value
+
+    def render(self):
+        for labels, value in sorted(self.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge:
+    """Current value partitioned by label values, e.g. viewers per lot"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames=("lot",)):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._changed = set()
+        self._lock = threading.Lock()
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+            self._changed.add(labels)
+
+    def remove(self, *labels):
+        """Drop a series, e.g. when the run that set it ends"""
+        with self._lock:
+            self._values.pop(labels, None)
+            self._changed.add(labels)
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def drain(self) -> dict:
+        """Series set or removed since the last drain; None marks a removal"""
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            return {labels: self._values.get(labels) for labels in changed}
+
+    def merge(self, values: dict):
+        with self._lock:
+            for labels, value in values.items():
+                if value is None:
+                    self._values.pop(labels, None)
+                else:
+                    self._values[labels] = value
+
+    def render(self):
+        for labels, value in sorted(self.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Bucket counts with sum and count, partitioned by label values.
+
+    observe() is one bisect and three additions; counts are kept per bucket
+    and only made cumulative when read.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets, labelnames=("lot",)):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labels, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # One count per bucket plus the +Inf overflow, then the sum and the count
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _cumulative(self, counts):
+        return list(accumulate(counts))
+
+    def summary(self, *labels) -> dict:
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                return {"count": 0, "sum": 0.0, "buckets": {}}
+            counts, total, count = entry[0][:], entry[1], entry[2]
+        return {
+            "count": count,
+            "sum": total,
+            "buckets": {str(bound): n for bound, n in zip(self.buckets, self._cumulative(counts))},
+        }
+
+    def labels(self):
+        with self._lock:
+            return list(self._values)
+
+    def drain(self) -> dict:
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values: dict):
+        with self._lock:
+            for labels, (counts, total, count) in values.items():
+                entry = self._values.get(labels)
+                if entry is None:
+                    self._values[labels] = [list(counts), total, count]
+                    continue
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+
+    def render(self):
+        with self._lock:
+            entries = sorted((labels, entry[0][:], entry[1], entry[2]) for labels, entry in self._values.items())
+        for labels, counts, total, count in entries:
+            cumulative = self._cumulative(counts)
+            bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, n in zip(bounds, cumulative):
+                le = 'le="' + bound + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {n}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+class StageTimer:
+    """Splits one frame's wall time across named pipeline stages.
+
+    lap(stage) charges the time since the previous lap (or start()) to `stage`;
+    laps of the same stage within a frame add up.
+    """
+
+    def __init__(self):
+        self.laps = {}
+        self._last = time.perf_counter()
+
+    def start(self):
+        self.laps = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.laps[stage] = self.laps.get(stage, 0.0) + now - self._last
+        self._last = now
+
+
+class NullTimer:
+    """Stands in for a StageTimer when nothing is being measured"""
+
+    def start(self):
+        pass
+
+    def lap(self, stage: str):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+FRAMES_PROCESSED = Counter("detector_frames_total", "Frames run through a lot's detector")
+DETECTIONS = Counter("detector_detections_total", "Frames on which occupancy was evaluated")
+SLOTS_EVALUATED = Counter("detector_slots_evaluated_total", "Slots re-thresholded and re-counted")
+SLOTS_SKIPPED = Counter("detector_slots_skipped_total", "Slots whose cached occupancy was reused because their pixels did not change")
+
+FRAMES_DECODED = Counter("source_frames_decoded_total", "Frames decoded from a lot's video source")
+FRAMES_DROPPED = Counter("source_frames_dropped_total", "Decoded frames overwritten before detection reached them")
+FRAMES_SKIPPED = Counter("detector_frames_skipped_total", "Frames skipped unprocessed to catch up with real time")
+TARGET_FPS = Gauge("detector_target_fps", "Frame rate a lot's source should be processed at")
+ACTUAL_FPS = Gauge("detector_actual_fps", "Frames a lot actually processed per second, over the last couple of seconds")
+STAGE_SECONDS = Histogram("detector_stage_seconds", "Time one frame spent in each pipeline stage",
+                          (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+                          labelnames=("lot", "stage"))
+
+ENCODE_SECONDS = Histogram("stream_encode_seconds", "Time to JPEG-encode one streamed frame",
+                           (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25))
+ENCODE_BYTES = Histogram("stream_encode_bytes", "Size of one encoded JPEG frame",
+                         (5e3, 1e4, 2e4, 5e4, 1e5, 2e5, 5e5, 1e6))
+STREAM_VIEWERS = Gauge("stream_viewers", "Clients currently watching a lot's stream")
+STREAM_FRAMES_DROPPED = Counter("stream_frames_dropped_total",
+                                "Streamed frames a viewer missed because it was still sending an older one")
+
+NOTIFIER_PENDING = Gauge("notifier_pending_updates", "Slot updates queued for the backend", labelnames=())
+NOTIFY_SECONDS = Histogram("notifier_post_seconds", "Latency of one slot-update POST to the backend",
+                           (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0), labelnames=("endpoint",))
+NOTIFY_FAILURES = Counter("notifier_post_failures_total", "Slot-update POSTs that failed or timed out",
+                          labelnames=("endpoint",))
+
+REGISTRY = (
+    FRAMES_DECODED, FRAMES_DROPPED, FRAMES_SKIPPED, TARGET_FPS, ACTUAL_FPS,
+    FRAMES_PROCESSED, DETECTIONS, SLOTS_EVALUATED, SLOTS_SKIPPED, STAGE_SECONDS,
+    ENCODE_SECONDS, ENCODE_BYTES, STREAM_VIEWERS, STREAM_FRAMES_DROPPED,
+    NOTIFIER_PENDING, NOTIFY_SECONDS, NOTIFY_FAILURES,
+)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def observe_stages(lot: str, laps: dict):
+    for stage, seconds in laps.items():
+        STAGE_SECONDS.observe(lot, stage, value=seconds)
+
+
+def drain_metrics() -> dict:
+    """Everything recorded in this process since the last drain, for a pool worker to ship to the API process"""
+    return {metric.name: values for metric in REGISTRY if (values := metric.drain())}
+
+
+def merge_metrics(snapshot: dict):
+    by_name = {metric.name: metric for metric in REGISTRY}
+    for name, values in snapshot.items():
+        metric = by_name.get(name)
+        if metric is not None:
+            metric.merge(values)
+
+
+def render_prometheus() -> str:
+    """Every metric in the Prometheus text exposition format, for the /metrics endpoint"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def lot_stats():
+    """Per-lot detector counters with the slot skip ratio, for the /stats endpoint"""
+    stats = {}
+    for counter in (FRAMES_PROCESSED, DETECTIONS, SLOTS_EVALUATED, SLOTS_SKIPPED):
+        for (lot,), value in counter.items():
+            stats.setdefault(lot, {})[counter.name] = int(value)
+    for values in stats.values():
+        evaluated = values.get(SLOTS_EVALUATED.name, 0)
+        skipped = values.get(SLOTS_SKIPPED.name, 0)
+        total = evaluated + skipped
+        values["slot_skip_ratio"] = round(skipped / total, 4) if total else 0.0
+    for gauge in (TARGET_FPS, ACTUAL_FPS):
+        for (lot,), value in gauge.items():
+            stats.setdefault(lot, {})[gauge.name] = round(value, 2)
+    for histogram in (ENCODE_SECONDS, ENCODE_BYTES):
+        for labels in histogram.labels():
+            stats.setdefault(labels[0], {})[histogram.name] = histogram.summary(*labels)
+    return stats
@@ -1,17 +1,165 @@
 import requests
 import os
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from app.utils.metrics import NOTIFIER_PENDING, NOTIFY_SECONDS, NOTIFY_FAILURES
+
+logger = logging.getLogger(__name__)
 
 # Use environment variable with fallback for production deployment
 NODE_SERVER_URL = os.getenv("NODE_SERVER_URL", "https://parkkar.onrender.com/api/v1/parkings/slot-update")
+# Optional endpoint accepting {"updates": [{"parkingId", "freeSlots"}, ...]} in one POST
+NODE_BATCH_URL = os.getenv("NODE_BATCH_URL")
+NOTIFIER_MAX_PENDING = int(os.getenv("NOTIFIER_MAX_PENDING", "1000"))
+NOTIFIER_TIMEOUT = float(os.getenv("NOTIFIER_TIMEOUT", "2"))
+
+
+class SlotUpdateNotifier:
+    """Sends slot updates from a background thread so detection never waits on the network.
+
+    Pending updates are kept per parkingId, so a burst of changes for one lot
+    collapses into a single POST carrying the latest count. Requests reuse a
+    keep-alive session, and when a batch URL is configured all lots with a
+    pending update go out in one request.
+    """
+
+    def __init__(self, url: str = NODE_SERVER_URL, batch_url: str = NODE_BATCH_URL,
+                 max_pending: int = NOTIFIER_MAX_PENDING, timeout: float = NOTIFIER_TIMEOUT):
+        self.url = url
+        self.batch_url = batch_url
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._in_flight = False
+        self._closed = False
+        self._worker = None
+        self._failures = 0
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def send(self, parking_id: str, slot_count: int):
+        """Queue the latest free-slot count for a lot; never blocks"""
+        with self._cond:
+            if self._closed:
+                return
+            if parking_id in self._pending:
+                self._pending.move_to_end(parking_id)
+            elif len(self._pending) >= self.max_pending:
+                dropped, _ = self._pending.popitem(last=False)
+                logger.warning(f"[Notifier] Queue full, dropped pending update for {dropped}")
+            self._pending[parking_id] = slot_count
+            NOTIFIER_PENDING.set(value=len(self._pending))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="slot-notifier", daemon=True)
+                self._worker.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                updates, self._pending = self._pending, OrderedDict()
+                self._in_flight = True
+                NOTIFIER_PENDING.set(value=0)
+
+            failed = self._deliver(updates)
+
+            with self._cond:
+                self._in_flight = False
+                closed = self._closed
+                if not closed:
+                    for parking_id, slot_count in failed.items():
+                        # A newer count queued meanwhile supersedes the one that failed
+                        self._pending.setdefault(parking_id, slot_count)
+                NOTIFIER_PENDING.set(value=len(self._pending))
+                self._cond.notify_all()
+
+            if failed and not closed:
+                self._failures += 1
+                with self._cond:
+                    self._cond.wait_for(lambda: self._closed, min(2 ** self._failures, 30))
+            else:
+                self._failures = 0
+
+    def _post(self, endpoint: str, url: str, payload):
+        """One timed POST; failures (including error statuses) are counted and re-raised"""
+        start = time.monotonic()
+        try:
+            r = self._session.post(url, json=payload, timeout=self.timeout)
+            if endpoint != "batch" or r.status_code not in (404, 405):
+                r.raise_for_status()
+            return r
+        except requests.RequestException:
+            NOTIFY_FAILURES.inc(endpoint)
+            raise
+        finally:
+            NOTIFY_SECONDS.observe(endpoint, value=time.monotonic() - start)
+
+    def _deliver(self, updates) -> dict:
+        """POST a set of updates; returns the ones that could not be delivered"""
+        if self.batch_url and len(updates) > 1:
+            payload = {"updates": [
+                {"parkingId": parking_id, "freeSlots": slot_count}
+                for parking_id, slot_count in updates.items()
+            ]}
+            try:
+                r = self._post("batch", self.batch_url, payload)
+                if r.status_code in (404, 405):
+                    logger.warning("[Notifier] Batch endpoint not supported, falling back to single updates")
+                    self.batch_url = None
+                else:
+                    logger.info(f"[Notifier] Sent {len(updates)} slot updates in one batch")
+                    return {}
+            except requests.RequestException as e:
+                logger.error(f"[Notifier ERROR] Failed to send batched slot updates: {e}")
+                return updates
+
+        failed = {}
+        for parking_id, slot_count in updates.items():
+            payload = {
+                "parkingId": parking_id,
+                "freeSlots": slot_count
+            }
+            try:
+                self._post("single", self.url, payload)
+                logger.info(f"[Notifier] Sent slot update for {parking_id}: {slot_count}")
+            except requests.RequestException as e:
+                logger.error(f"[Notifier ERROR] Failed to send slot update for {parking_id}: {e}")
+                failed[parking_id] = slot_count
+        return failed
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until nothing is pending or in flight; True if the queue drained in time"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._worker is None:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 5.0):
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._session.close()
+
+
+notifier = SlotUpdateNotifier()
+atexit.register(notifier.close, 2.0)
+
 
 def send_slot_update(parking_id: str, slot_count: int):
-    payload = {
-        "parkingId": parking_id,
-        "freeSlots": slot_count
-    }
-    try:
-        r = requests.post(NODE_SERVER_URL, json=payload, timeout=2)
-        r.raise_for_status()
-        print(f"[Notifier] Sent slot update: {slot_count}")
-    except requests.RequestException as e:
-        print(f"[Notifier ERROR] Failed to send slot update: {e}")
+    notifier.send(parking_id, slot_count)
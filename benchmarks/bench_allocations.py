@@ -0,0 +1,108 @@
+"""Allocation benchmark: per-frame allocating preprocessing vs. the preallocated Preprocessor.
+
+Each mode runs in a fresh interpreter over the same frames of the bundled chemistry
+video (decoded once, then cycled) and reports time, minor page faults, peak RSS and
+the image memory allocated per frame.
+
+Run from the project root:  python -m benchmarks.bench_allocations [--frames 10000]
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import cv2
+from app.detection.occupancy import SlotGeometry
+from app.detection.pipeline import Preprocessor, RoiPlan, preprocess, preprocess_rois
+from app.detection.registry import registry
+
+CHEMISTRY_ID = "5c88fa8cf4afda39709c2970"
+MODES = ("allocating", "preallocated")
+TRACE_FRAMES = 200
+# Frames kept decoded in memory and cycled; small enough not to swamp the RSS figure
+CACHED_FRAMES = 30
+
+
+def load_frames(limit: int = 0):
+    config = registry.get(CHEMISTRY_ID)
+    cap = cv2.VideoCapture(config.resolve(config.video_source))
+    frames = []
+    while not limit or len(frames) < limit:
+        success, img = cap.read()
+        if not success:
+            break
+        frames.append(img)
+    cap.release()
+    return config.load_geometry(), frames
+
+
+def make_step(mode: str, geometry: SlotGeometry, shape, roi: bool):
+    if mode == "preallocated":
+        return Preprocessor(geometry, roi)
+    if not roi:
+        return preprocess
+    plan = RoiPlan.build(geometry, shape)
+    return lambda img: preprocess_rois(img, plan)
+
+
+def run_mode(mode: str, n_frames: int, roi: bool):
+    geometry, frames = load_frames(CACHED_FRAMES)
+    step = make_step(mode, geometry, frames[0].shape, roi)
+    for img in frames[:10]:
+        step(img)
+
+    start_faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    start = time.perf_counter()
+    for index in range(n_frames):
+        step(frames[index % len(frames)])
+    elapsed = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    # Separate, short traced pass: tracemalloc sees numpy/OpenCV image buffers but slows the loop
+    tracemalloc.start()
+    allocated = 0
+    for index in range(TRACE_FRAMES):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        step(frames[index % len(frames)])
+        allocated += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    return {
+        "mode": mode,
+        "frames": n_frames,
+        "ms_per_frame": elapsed / n_frames * 1e3,
+        "minor_faults_per_frame": (usage.ru_minflt - start_faults) / n_frames,
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "alloc_bytes_per_frame": allocated / TRACE_FRAMES,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=10000)
+    parser.add_argument('--full-frame', action='store_true', help='Disable ROI preprocessing')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.frames, not args.full_frame)))
+        return
+
+    extra = ['--full-frame'] if args.full_frame else []
+    print(f"chemistry video, {args.frames} frames, {'full-frame' if args.full_frame else 'ROI'} preprocessing")
+    print(f"{'mode':>13} {'ms/frame':>9} {'faults/frame':>13} {'alloc KiB/frame':>16} {'peak RSS MiB':>13}")
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_allocations', '--mode', mode, '--frames', str(args.frames)] + extra,
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>13} {result['ms_per_frame']:>9.3f} {result['minor_faults_per_frame']:>13.1f} "
+              f"{result['alloc_bytes_per_frame'] / 1024:>16.1f} {result['peak_rss_mb']:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Micro-benchmark: per-slot countNonZero loop vs. integral-image occupancy, and per-frame vs. batched calls.
+
+Run from the project root:  python -m benchmarks.bench_occupancy [--batch 32]
+"""
+import argparse
+import time
+import numpy as np
+from app.detection.occupancy import SlotGeometry, count_nonzero_loop, count_nonzero_rois, occupancy, occupancy_batch
+
+
+def make_frame(height: int, width: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random((height, width)) < 0.3, 255, 0).astype(np.uint8)
+
+
+def make_geometry(n_slots: int, frame_shape, slot_w: int = 60, slot_h: int = 120, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    h, w = frame_shape
+    xs = rng.integers(0, w - slot_w, n_slots)
+    ys = rng.integers(0, h - slot_h, n_slots)
+    return SlotGeometry.build(list(zip(xs.tolist(), ys.tolist())), slot_w, slot_h)
+
+
+def best_of(fn, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slots', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--batch', type=int, default=0, help='Also time N frames per call against N single calls')
+    args = parser.parse_args()
+
+    frame = make_frame(args.height, args.width)
+    print(f"frame {args.width}x{args.height}, best of {args.repeat}")
+    print(f"{'slots':>6} {'loop ms':>10} {'integral ms':>12} {'speedup':>8}")
+    for n_slots in args.slots:
+        geometry = make_geometry(n_slots, frame.shape)
+        assert np.array_equal(count_nonzero_loop(frame, geometry), count_nonzero_rois(frame, geometry))
+        loop = best_of(lambda: count_nonzero_loop(frame, geometry), args.repeat)
+        vectorized = best_of(lambda: count_nonzero_rois(frame, geometry), args.repeat)
+        print(f"{n_slots:>6} {loop * 1e3:>10.3f} {vectorized * 1e3:>12.3f} {loop / vectorized:>7.1f}x")
+
+    if not args.batch:
+        return
+    stack = np.stack([make_frame(args.height, args.width, seed) for seed in range(args.batch)])
+    repeat = max(1, args.repeat // 10)
+    print(f"\n{args.batch} frames per batch, 5-frame majority vote, best of {repeat}")
+    print(f"{'slots':>6} {'per-frame ms':>13} {'batched ms':>11} {'speedup':>8}")
+    for n_slots in args.slots:
+        geometry = make_geometry(n_slots, frame.shape)
+        threshold = geometry.areas(frame.shape) * 0.3
+        single = best_of(lambda: [occupancy(img, geometry, threshold) for img in stack], repeat)
+        batched = best_of(lambda: occupancy_batch(stack, geometry, threshold, window=5), repeat)
+        print(f"{n_slots:>6} {single * 1e3:>13.3f} {batched * 1e3:>11.3f} {single / batched:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""Pipeline benchmark: every lot's detector run headless, with per-stage timings.
+
+Lots with a bundled video (chemistry, workshop) are decoded from it; the others run on
+synthetic frames sized to their slot layout. Nothing sleeps and slot updates are
+discarded rather than POSTed. Each lot runs in a fresh interpreter and reports frames/sec,
+p50/p99 per-frame latency, time per stage (decode, gray/blur, adaptive threshold, median,
+dilate, occupancy, encode, ...) and peak RSS.
+
+Run from the project root:
+    python -m benchmarks.bench_pipeline [--frames 1000] [--output BENCH.json] [--compare OLD.json]
+"""
+import argparse
+import dataclasses
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import defaultdict
+import cv2
+import numpy as np
+from app.detection.detector import ParkingDetector
+from app.detection.encoder import FrameEncoder, make_backend
+from app.detection.registry import registry
+from app.detection.sources import FrameSource, open_source
+from app.utils.metrics import StageTimer
+
+SYNTHETIC_FPS = 25.0
+SYNTHETIC_FRAMES = 50  # distinct synthetic frames, generated up front and cycled
+SYNTHETIC_MARGIN = 40
+WARMUP_FRAMES = 5
+
+
+class SyntheticSource(FrameSource):
+    """Textured frames at processing resolution with slot-sized blocks that come and go"""
+
+    fps = SYNTHETIC_FPS
+
+    def __init__(self, config, n_frames: int, seed: int = 0):
+        rois = config.load_geometry().rois
+        h = int(rois[:, 3].max(initial=0)) + SYNTHETIC_MARGIN
+        w = int(rois[:, 2].max(initial=0)) + SYNTHETIC_MARGIN
+        rng = np.random.default_rng(seed)
+        base = rng.integers(0, 256, (h, w, 3), np.uint8)
+        base = cv2.GaussianBlur(base, (0, 0), 3)
+        self.frames = []
+        for index in range(SYNTHETIC_FRAMES):
+            img = base.copy()
+            # Park a "car" in roughly half the slots, changing every few frames
+            parked = np.random.default_rng(seed + index // 10).random(len(rois)) < 0.5
+            for (x0, y0, x1, y1), car in zip(rois.tolist(), parked.tolist()):
+                if car:
+                    cv2.rectangle(img, (x0 + 8, y0 + 8), (x1 - 8, y1 - 8), (40, 40, 40), 3)
+            self.frames.append(img)
+        self.n_frames = n_frames or len(self.frames)
+        self.index = 0
+
+    def read(self):
+        if self.index >= self.n_frames:
+            return None
+        img = self.frames[self.index % len(self.frames)]
+        timestamp = self.index / self.fps
+        self.index += 1
+        # A fresh copy per frame, as a decoder would hand out, since the overlay draws in place
+        return img.copy(), timestamp
+
+
+def open_bench_source(config, n_frames: int):
+    if os.path.exists(config.resolve(config.video_source)):
+        return open_source(config), "video"
+    return SyntheticSource(config, n_frames), "synthetic"
+
+
+def percentile_ms(values, q: float) -> float:
+    return float(np.percentile(values, q)) * 1e3 if len(values) else 0.0
+
+
+def run_lot(parking_id: str, n_frames: int, encode: bool, every_frame: bool) -> dict:
+    overrides = dict(prefetch_frames=0, min_update_interval=0.0, end_policy="loop" if n_frames else "stop")
+    if every_frame:
+        overrides.update(detect_hz=0, motion_gating=False)
+    config = dataclasses.replace(registry.get(parking_id), geometry=None, **overrides)
+    source, kind = open_bench_source(config, n_frames + WARMUP_FRAMES if n_frames else 0)
+    timer = StageTimer()
+    detector = ParkingDetector(config, notify=lambda parking_id, free_slots: None, timer=timer)
+    encoder = FrameEncoder(config, source.fps) if encode else None
+
+    latencies = []
+    stages = defaultdict(list)
+    frames = 0
+    start = None
+    warm_detections = 0
+    try:
+        while not n_frames or frames < n_frames + WARMUP_FRAMES:
+            timer.start()
+            frame = source.read()
+            if frame is None:
+                break
+            timer.lap("decode")
+            img = detector.process(frame[0], frame[1], render=encode)
+            if encode:
+                encoder.encode(img)
+                timer.lap("encode")
+            frames += 1
+            if frames == WARMUP_FRAMES:
+                start = time.perf_counter()
+                warm_detections = detector.detections
+            if frames <= WARMUP_FRAMES:
+                continue
+            latencies.append(sum(timer.laps.values()))
+            for stage, seconds in timer.laps.items():
+                stages[stage].append(seconds)
+    finally:
+        source.close()
+    elapsed = time.perf_counter() - start if start is not None else 0.0
+    measured = len(latencies)
+    total = sum(latencies)
+
+    return {
+        "lot": config.name,
+        "parking_id": parking_id,
+        "source": kind,
+        "frame_shape": list(img.shape[:2]) if frames else None,
+        "slots": len(detector.geometry),
+        "frames": measured,
+        "detections": detector.detections - warm_detections,
+        "fps": measured / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": total / measured * 1e3 if measured else 0.0,
+            "p50": percentile_ms(latencies, 50),
+            "p99": percentile_ms(latencies, 99),
+            "max": max(latencies) * 1e3 if measured else 0.0,
+        },
+        "stages": {
+            stage: {
+                # Per processed frame, so stages that skip frames (detection, overlay) weigh in fairly
+                "ms_per_frame": sum(times) / measured * 1e3,
+                "share": sum(times) / total if total else 0.0,
+                "frames": len(times),
+                "p50_ms": percentile_ms(times, 50),
+                "p99_ms": percentile_ms(times, 99),
+            }
+            for stage, times in sorted(stages.items(), key=lambda item: -sum(item[1]))
+        },
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True,
+                                capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "jpeg_encoder": make_backend().name,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def print_report(report: dict):
+    for result in report["lots"]:
+        latency = result["latency_ms"]
+        print(f"\n{result['lot']} ({result['source']}, {result['slots']} slots, {result['frames']} frames, "
+              f"{result['detections']} detections): {result['fps']:.1f} fps, "
+              f"p50 {latency['p50']:.2f} ms, p99 {latency['p99']:.2f} ms, peak RSS {result['peak_rss_mb']:.0f} MiB")
+        print(f"  {'stage':>10} {'ms/frame':>9} {'share':>6} {'frames':>7} {'p99 ms':>8}")
+        for stage, values in result["stages"].items():
+            print(f"  {stage:>10} {values['ms_per_frame']:>9.3f} {values['share']:>6.1%} "
+                  f"{values['frames']:>7} {values['p99_ms']:>8.3f}")
+
+
+def print_comparison(report: dict, baseline: dict):
+    before = {result["parking_id"]: result for result in baseline["lots"]}
+    print(f"\nagainst {baseline['environment'].get('commit')}:")
+    if baseline.get("settings") != report["settings"]:
+        print(f"  (settings differ: {baseline.get('settings')} then, {report['settings']} now)")
+    print(f"  {'lot':>10} {'fps':>16} {'p99 ms':>16}")
+    for result in report["lots"]:
+        old = before.get(result["parking_id"])
+        if old is None:
+            continue
+        fps_change = result["fps"] / old["fps"] - 1 if old["fps"] else 0.0
+        p99_change = result["latency_ms"]["p99"] / old["latency_ms"]["p99"] - 1 if old["latency_ms"]["p99"] else 0.0
+        print(f"  {result['lot']:>10} {result['fps']:>7.1f} ({fps_change:>+6.1%}) "
+              f"{result['latency_ms']['p99']:>7.2f} ({p99_change:>+6.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lots', nargs='+', help='Parking lot IDs or names (default: every lot)')
+    parser.add_argument('--frames', type=int, default=0,
+                        help='Frames per lot, looping the video as needed (default: one pass)')
+    parser.add_argument('--no-encode', action='store_true', help='Skip the overlay and JPEG encoding')
+    parser.add_argument('--every-frame', action='store_true',
+                        help='Detect every slot on every frame (no cadence or motion gating)')
+    parser.add_argument('--output', help='Write the JSON report here ("-" for stdout)')
+    parser.add_argument('--compare', help='Earlier JSON report to compare fps and p99 latency against')
+    parser.add_argument('--lot', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    flags = (['--no-encode'] if args.no_encode else []) + (['--every-frame'] if args.every_frame else [])
+
+    if args.lot:
+        print(json.dumps(run_lot(args.lot, args.frames, not args.no_encode, args.every_frame)))
+        return
+
+    names = {registry.get(parking_id).name: parking_id for parking_id in registry.ids()}
+    ids = [names.get(lot, lot) for lot in args.lots] if args.lots else list(registry.ids())
+    for parking_id in ids:
+        if parking_id not in registry:
+            parser.error(f"Unknown parking lot: {parking_id}")
+
+    report = {
+        "environment": environment(),
+        "settings": {"frames": args.frames, "encode": not args.no_encode, "every_frame": args.every_frame},
+        "lots": [],
+    }
+    for parking_id in ids:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_pipeline', '--lot', parking_id, '--frames', str(args.frames)]
+            + flags, check=True, capture_output=True, text=True
+        ).stdout
+        report["lots"].append(json.loads(output.strip().splitlines()[-1]))
+
+    if args.output == '-':
+        print(json.dumps(report, indent=2))
+        return
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nreport written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()